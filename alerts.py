@@ -0,0 +1,84 @@
+################################################################################
+#
+#   AlertQueue Class
+#
+#   - A "breaking news" line that cuts in ahead of the regular playlist.
+#     Segments post urgent items (the ISS passing overhead in a few minutes,
+#     a new weather warning) with SegmentParent.post_alert(), from any thread.
+#   - Between segments, the main loop shows any waiting alerts, most urgent
+#     first, and then carries on with the playlist where it left off.  So an
+#     alert never waits longer than the rest of the segment that's showing
+#     when it comes in (and that's capped by the segment's show_timeout).
+#   - Each alert has a deadline.  One that can't be shown in time is dropped,
+#     since old breaking news isn't worth interrupting for.
+#   - Alerts are identified by a key, and the same key is only ever shown
+#     once a day, so segments can just keep posting whatever's urgent
+#     without worrying about repeats
+#   - Keeps track of how long alerts wait to be shown, for the headless report
+#
+################################################################################
+
+import clock
+import datetime as dt
+import heapq
+import itertools
+import threading
+
+
+# How long to remember an alert's key, so it doesn't get shown again
+REMEMBER_FOR = dt.timedelta(hours=24)
+
+
+class AlertQueue:
+
+    def __init__(self):
+        self._heap = []
+        self._order = itertools.count()
+        # When each alert key was posted (by clock.now())
+        self._seen = {}
+        self._lock = threading.Lock()
+        # Number of alerts shown, their total and longest wait times
+        # (seconds, on clock.monotonic()), and the number that missed their
+        # deadline.  Just running totals, since the feed can go on forever.
+        self.shown = 0
+        self.total_latency = 0
+        self.max_latency = 0
+        self.missed = 0
+
+
+    # Adds an alert, unless one with the same key has been posted recently.
+    # Higher priority alerts go first, then those with the earliest deadline.
+    def post(self, key, title, lines, deadline, priority=0):
+        now = clock.now()
+        with self._lock:
+            self._seen = {k:t for k, t in self._seen.items() if now - t < REMEMBER_FOR}
+            if key in self._seen:
+                return False
+            self._seen[key] = now
+            alert = {'key':key,
+                     'title':title,
+                     'lines':lines,
+                     'deadline':deadline,
+                     'priority':priority,
+                     'posted_at':clock.monotonic(),
+                    }
+            heapq.heappush(self._heap, (-priority, deadline, next(self._order), alert))
+        return True
+
+
+    # Returns the most urgent alert that can still be shown in time, or None.
+    # Call when the alert is about to be shown.
+    def next(self):
+        now = clock.now()
+        with self._lock:
+            while len(self._heap) > 0:
+                alert = heapq.heappop(self._heap)[-1]
+                if alert['deadline'] <= now:
+                    self.missed += 1
+                    continue
+                latency = clock.monotonic() - alert['posted_at']
+                self.shown += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+                return alert
+        return None
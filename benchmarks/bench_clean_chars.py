@@ -0,0 +1,85 @@
+################################################################################
+#
+#   Benchmark:  Display.clean_chars()
+#
+#   Times the table-driven clean_chars() against the original character-by-
+#   character version on full-length news article bodies.
+#
+#   Run from the main RetroFeed directory:
+#
+#       python benchmarks/bench_clean_chars.py [text files...]
+#
+#   With no arguments, a made-up AP-style article (curly quotes, dashes,
+#   accented names and all) is used.  Pass one or more saved article text
+#   files to time real ones instead.
+#
+################################################################################
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from display import Display
+
+
+PARAGRAPH = ('WASHINGTON (AP) — The Senate voted 52-48 late Tuesday to keep '
+             'the government open through the end of the fiscal year, capping '
+             'weeks of negotiations over spending levels, disaster aid and a '
+             'handful of policy riders that had threatened to sink the deal. '
+             'The measure now heads to the House, where leaders said they '
+             'expected a vote as soon as Thursday. “We got it done,” said '
+             'Sen. José Núñez, adding that it’s “just the start.”\n')
+ARTICLE = PARAGRAPH * 12
+
+
+# The original clean_chars() loop, kept here for comparison
+def clean_chars_original(s):
+    new_s = ''
+    for c in s:
+        u = ord(c)
+        if u == 9:
+            new_s += '    '
+            continue
+        if u >= 0x2013:
+            if 0x2013 <= u <= 0x2017:
+                new_s += '-'
+            elif u == 0x201C or u == 0x201D:
+                new_s += '"'
+            elif u == 0x2018 or u == 0x2019:
+                new_s += "'"
+            elif u == 0x2022:
+                new_s += "*"
+            elif u == 0x2026:
+                new_s += '...'
+        elif (32 <= u <= 126):
+            new_s += c
+    return new_s.strip()
+
+
+def time_it(func, texts, repeat=5, number=50):
+    best = min(timeit.repeat(lambda: [func(t) for t in texts],
+                             repeat=repeat, number=number))
+    return best / number
+
+
+def main():
+    texts = []
+    for filename in sys.argv[1:]:
+        with open(filename, encoding='utf-8') as f:
+            texts.append(f.read())
+    if len(texts) == 0:
+        texts.append(ARTICLE)
+    total_chars = sum(len(t) for t in texts)
+    d = Display({})
+
+    print(f'{len(texts)} article(s), {total_chars:,} characters total')
+    original = time_it(clean_chars_original, texts)
+    current = time_it(d.clean_chars, texts)
+    print(f'  Original loop:  {original * 1000:8.3f} ms')
+    print(f'  Table-driven:   {current * 1000:8.3f} ms')
+    print(f'  Speedup:        {original / current:8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+################################################################################
+#
+#   Benchmark:  HTML parsing
+#
+#   For each segment's page, compares parsing the whole thing with the
+#   html.parser backend (the old way) against parsing only the elements the
+#   segment actually uses (its SoupStrainer), with each available backend.
+#   Reports the time per parse and the peak memory used while parsing.
+#   (wiki_on_this_day doesn't build a tree at all, but parses the page as a
+#   stream and stops after the list it needs, so that's what's timed for it.)
+#
+#   Run from the main RetroFeed directory:
+#
+#       python benchmarks/bench_parsers.py [--fetch] [fixtures directory]
+#
+#   The fixtures directory (benchmarks/fixtures by default) holds saved copies
+#   of the pages, named as in PAGES below.  Use --fetch to download fresh
+#   copies into it first.  Pages without a saved copy are made up instead
+#   (marked with a * in the results), by make_page():  the bits each segment
+#   reads, buried in a real page's worth of scripts, styles, menus, and other
+#   clutter, so the comparison still means something offline.
+#
+################################################################################
+
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from bs4 import BeautifulSoup
+import segment_parent
+from segments import ap_news, spot_the_station, us_weather, wiki_on_this_day, yahoo_finance
+
+
+# (name, fixture file, url, strainer)
+PAGES = [('ap_news hub', 'ap_hub.html',
+          'https://apnews.com/hub/ap-top-news',
+          ap_news.HUB_ONLY),
+         ('ap_news story', 'ap_story.html',
+          None,  # Filled in from the hub page, when fetching
+          ap_news.STORY_ONLY),
+         ('yahoo_finance', 'yahoo.html',
+          'https://finance.yahoo.com',
+          yahoo_finance.STREAMERS_ONLY),
+         ('spot_the_station', 'spot.html',
+          'https://spotthestation.nasa.gov/sightings/view.cfm?country=United_States&region=Tennessee&city=Nashville',
+          spot_the_station.WIDGET_ONLY),
+         ('us_weather', 'weather.html',
+          'https://forecast.weather.gov/MapClick.php?lat=36.118542&lon=-86.798358',
+          us_weather.FORECAST_ONLY),
+         ('wiki_on_this_day', 'wiki.html',
+          'https://en.wikipedia.org/wiki/Wikipedia:Selected_anniversaries/January_1',
+          None),
+        ]
+
+
+# Made-up pages, for when there's no saved copy.  Sizes are roughly those of
+# the real pages.  (fixture file: (filler blocks, function returning the
+# part the segment reads))
+def page_furniture(count, seed):
+    blocks = []
+    for i in range(count):
+        n = seed * 1000 + i
+        links = ''.join(f'<li class="Nav-item"><a class="Nav-link" href="/section/{n}/{j}">'
+                        f'Section {n}.{j}</a></li>' for j in range(6))
+        blocks.append(f'<div class="Wrapper Wrapper-{n % 7}" data-module-id="{n}">'
+                      f'<nav class="Nav"><ul class="Nav-items">{links}</ul></nav>'
+                      f'<script type="application/json">{{"id": {n}, "track": true, '
+                      f'"props": {{"slot": "ad-{n}", "sizes": [[300, 250], [728, 90]]}}}}</script>'
+                      f'<style>.Wrapper-{n % 7} .Nav-link:hover {{ color: #{n % 4096:03x}; }}</style>'
+                      f'<div class="Promo"><img src="/img/{n}.jpg" alt="" loading="lazy">'
+                      f'<p class="Promo-text">Sponsored content block number {n}, with '
+                      f'<span>some</span> <b>inline</b> <i>markup</i> in it.</p></div></div>\n')
+    return blocks
+
+
+def ap_hub_content():
+    return ''.join(f'<div class="PagePromo-content"><div class="PagePromo-title">'
+                   f'<a class="Link" href="https://apnews.com/article/story-{i}">'
+                   f'<span class="PagePromoContentIcons-text">Headline number {i} about '
+                   f'something that happened today</span></a></div>'
+                   f'<div class="PagePromo-description">A sentence or two summing up '
+                   f'story {i}.</div></div>\n' for i in range(60))
+
+
+def ap_story_content():
+    return ('<div class="RichTextStoryBody RichTextBody">'
+            + ''.join(f'<p>Paragraph {i} of the story, running on for a line or two, '
+                      f'with a <a href="/hub/{i}">link</a> now and then.</p>\n' for i in range(25))
+            + '</div>')
+
+
+def yahoo_content():
+    parts = []
+    for i in range(120):
+        symbol = ['^GSPC', '^DJI', '^IXIC', '^RUT', 'CL=F', 'GC=F'][i] if i < 6 else f'SYM{i}'
+        parts.append(f'<fin-streamer data-symbol="{symbol}" data-field="regularMarketPrice">'
+                     f'{4000 + i}.25</fin-streamer>'
+                     f'<fin-streamer data-symbol="{symbol}" data-field="regularMarketChange">'
+                     f'<span>+{i}.50</span></fin-streamer>'
+                     f'<fin-streamer data-symbol="{symbol}" data-field="regularMarketChangePercent">'
+                     f'<span>(+0.{i:02}%)</span></fin-streamer>\n')
+    return ''.join(parts)
+
+
+def spot_content():
+    sightings = '|'.join(f"{{ts '2024-01-0{i + 1} 18:12:00'}}:00.0,Mon Jan {i + 1},6:12 PM,"
+                           f"4 min,45°,10° above NW,10° above SE" for i in range(5))
+    return f'<div id="widget_info">{sightings}</div>'
+
+
+def weather_content():
+    cells = ''.join(f'<tr><td class="text-right"><b>{key}</b></td><td>{value}</td></tr>'
+                    for key, value in [('Humidity', '54%'), ('Wind Speed', 'S 8 mph'),
+                                       ('Barometer', '30.01 in'), ('Dewpoint', '48°F (9°C)'),
+                                       ('Visibility', '10.00 mi'), ('Last update', '1 Jan 5:53 pm CST')])
+    icons = ''.join(f'<img src="/icons/{i}.png" alt="Period {i}: Partly cloudy, with a high '
+                    f'near 60." class="forecast-icon">' for i in range(14))
+    return (f'<h2 class="panel-title">Nashville, Nashville International Airport (KBNA)</h2>'
+            f'<p class="myforecast-current">Fair</p><p class="myforecast-current-lrg">58°F</p>'
+            f'<p class="myforecast-current-sm">14°C</p><table>{cells}</table>{icons}')
+
+
+def wiki_content():
+    items = ''.join(f'<li><a href="/wiki/{1900 + i}">{1900 + i}</a> – Something that '
+                    f'happened on this day, number {i}.</li>' for i in range(8))
+    return ('<p><a href="/wiki/January_1" title="January 1">January 1</a></p>'
+            '<p><a href="/wiki/January_1" title="January 1">January 1</a></p>'
+            f'<ul>{items}</ul>')
+
+
+SYNTHETIC = {'ap_hub.html': (500, ap_hub_content),
+             'ap_story.html': (300, ap_story_content),
+             'yahoo.html': (700, yahoo_content),
+             'spot.html': (40, spot_content),
+             'weather.html': (60, weather_content),
+             'wiki.html': (150, wiki_content),
+            }
+
+
+# Puts the segment's part partway down the page, as on the real thing
+def make_page(file_name):
+    count, content = SYNTHETIC[file_name]
+    blocks = page_furniture(count, len(file_name))
+    middle = count // 3
+    return ('<!DOCTYPE html><html><head><title>Page</title>'
+            + ''.join(f'<script src="/js/bundle-{i}.js"></script>' for i in range(20))
+            + '</head><body>' + ''.join(blocks[:middle]) + content()
+            + ''.join(blocks[middle:]) + '</body></html>')
+
+
+# Streams the wiki page through the segment's parser, the way it comes in
+def parse_wiki(text):
+    parser = wiki_on_this_day.EventListParser('January 1', 'January_1')
+    for i in range(0, len(text), wiki_on_this_day.CHUNK_BYTES):
+        parser.feed(text[i:i + wiki_on_this_day.CHUNK_BYTES])
+        if parser.done:
+            break
+
+
+def available_parsers():
+    parsers = ['html.parser']
+    if segment_parent.HTML_PARSER != 'html.parser':
+        parsers.append(segment_parent.HTML_PARSER)
+    return parsers
+
+
+def fetch_fixtures(fixtures_dir):
+    import requests
+    os.makedirs(fixtures_dir, exist_ok=True)
+    story_url = None
+    for name, file_name, url, strainer in PAGES:
+        if name == 'ap_news story':
+            url = story_url
+        if url is None:
+            continue
+        print(f'Fetching {url}')
+        response = requests.get(url)
+        if response.status_code != 200:
+            print(f'    Got status {response.status_code}, skipping')
+            continue
+        with open(os.path.join(fixtures_dir, file_name), 'w', encoding='utf-8') as f:
+            f.write(response.text)
+        if name == 'ap_news hub':
+            soup = BeautifulSoup(response.text, 'html.parser', parse_only=strainer)
+            link = soup.find('a', 'Link')
+            story_url = link.get('href') if link is not None else None
+
+
+# Returns (seconds per parse, peak bytes allocated during one parse)
+def measure(text, parser, strainer):
+    def parse():
+        BeautifulSoup(text, parser, parse_only=strainer)
+    return measure_fn(parse)
+
+
+def measure_fn(parse):
+    timer = timeit.Timer(parse)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=3, number=number)) / number
+    tracemalloc.start()
+    parse()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time full vs. targeted HTML parsing of segment pages.')
+    parser.add_argument('--fetch', action='store_true',
+                        help='Download fresh copies of the pages into the fixtures directory first')
+    parser.add_argument('fixtures_dir', nargs='?',
+                        default=os.path.join(os.path.dirname(__file__), 'fixtures'))
+    args = parser.parse_args()
+
+    if args.fetch:
+        fetch_fixtures(args.fixtures_dir)
+        print()
+
+    print(f'{"Page":<18} {"KB":>6}  {"Parse":<22} {"ms":>8} {"Peak KB":>9} {"Speedup":>8}')
+    made_up = False
+    for name, file_name, url, strainer in PAGES:
+        path = os.path.join(args.fixtures_dir, file_name)
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+        else:
+            text = make_page(file_name)
+            name += ' *'
+            made_up = True
+        kb = len(text.encode()) / 1024
+        baseline, peak = measure(text, 'html.parser', None)
+        print(f'{name:<18} {kb:>6.0f}  {"full, html.parser":<22} {baseline*1000:>8.2f} {peak/1024:>9.0f} {"":>8}')
+        if strainer is None:
+            seconds, peak = measure_fn(lambda: parse_wiki(text))
+            print(f'{"":<18} {"":>6}  {"streaming, early exit":<22} {seconds*1000:>8.2f} {peak/1024:>9.0f} {baseline/seconds:>7.1f}x')
+            continue
+        for backend in available_parsers():
+            seconds, peak = measure(text, backend, strainer)
+            print(f'{"":<18} {"":>6}  {"targeted, " + backend:<22} {seconds*1000:>8.2f} {peak/1024:>9.0f} {baseline/seconds:>7.1f}x')
+    if made_up:
+        print()
+        print(f'* No saved copy in {args.fixtures_dir}, so a made-up page was used')
+
+
+if __name__ == '__main__':
+    main()
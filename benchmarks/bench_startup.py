@@ -0,0 +1,89 @@
+################################################################################
+#
+#   Benchmark:  Start-up time
+#
+#   Starts RetroFeed for real (not headless) and times how long it takes for
+#   the first character to be typed out, which is about how long someone
+#   looking at the screen waits for something to happen.  Screen-clearing
+#   codes and blank lines don't count.  RetroFeed is stopped as soon as the
+#   first character shows up.  For comparison, also times how long Python
+#   takes to start up and do nothing at all.
+#
+#   Run from the main RetroFeed directory:
+#
+#       python benchmarks/bench_startup.py [--runs N] [config file]
+#
+#   The config file defaults to config.toml.  Nothing gets fetched before the
+#   first character, so this works without a network connection.
+#
+################################################################################
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+ESC = 0x1b
+
+
+# Returns seconds from launch until the process writes something visible.
+# Skips whitespace and ANSI escape sequences.
+def time_to_first_char(command):
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, bufsize=0)
+    in_escape = False
+    seconds = None
+    try:
+        while seconds is None:
+            chunk = process.stdout.read(1)
+            if chunk == b'':
+                break
+            byte = chunk[0]
+            if in_escape:
+                # A CSI sequence ends with a byte from @ to ~ (but not the
+                # opening [)
+                if 0x40 <= byte <= 0x7e and byte != ord('['):
+                    in_escape = False
+            elif byte == ESC:
+                in_escape = True
+            elif not chr(byte).isspace():
+                seconds = time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+    return seconds
+
+
+def time_to_exit(command):
+    start = time.perf_counter()
+    subprocess.run(command, cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def report(name, times):
+    times = [t for t in times if t is not None]
+    if len(times) == 0:
+        print(f'{name:<24} {"(nothing printed)":>30}')
+        return
+    print(f'{name:<24} {min(times)*1000:>9.0f} {statistics.median(times)*1000:>9.0f} {max(times)*1000:>9.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time how long RetroFeed takes to type its first character.')
+    parser.add_argument('--runs', type=int, default=10, help='Number of times to start RetroFeed (default 10)')
+    parser.add_argument('filename', nargs='?', default='config.toml', help='Config file to start with')
+    args = parser.parse_args()
+
+    print(f'{"":<24} {"Min ms":>9} {"Median":>9} {"Max":>9}')
+    report('Python, doing nothing', [time_to_exit([sys.executable, '-c', 'pass']) for i in range(args.runs)])
+    report('First character', [time_to_first_char([sys.executable, 'retrofeed.py', args.filename])
+                               for i in range(args.runs)])
+
+
+if __name__ == '__main__':
+    main()
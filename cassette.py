@@ -0,0 +1,83 @@
+################################################################################
+#
+#   Cassette Class
+#
+#   - Records every web response the segments get into a "cassette"
+#     directory, and can play them back later instead of going to the network
+#   - Handy for running without a network connection (demos, say), and for
+#     testing or timing the segments against the exact same pages every time
+#   - Playback can add a delay to each response, to act like a real network
+#   - Chosen from the command line, with --record or --replay (see retrofeed.py)
+#
+#   Each url's latest response is kept in its own pickled file, named after a
+#   hash of the url.  Playing back a url that was never recorded gets a 404.
+#
+################################################################################
+
+import hashlib
+import os
+import pickle
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+class Cassette:
+
+    def __init__(self, directory, mode, latency=0):
+        if mode not in ('record', 'replay'):
+            raise RuntimeError(f'Unknown cassette mode "{mode}"')
+        self.directory = directory
+        self.mode = mode
+        self.latency = latency
+        if mode == 'record':
+            os.makedirs(directory, exist_ok=True)
+        elif not os.path.isdir(directory):
+            raise RuntimeError(f'Cassette directory "{directory}" not found')
+
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest() + '.response')
+
+
+    # Saves a response we got from the network
+    def record(self, url, response):
+        recording = {'url':url,
+                     'status_code':response.status_code,
+                     'reason':response.reason,
+                     'headers':dict(response.headers),
+                     'encoding':response.encoding,
+                     'content':response.content,
+                    }
+        path = self._path(url)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(recording, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+
+    # Returns a Response object for the url, played back from the cassette
+    def replay(self, url):
+        if self.latency > 0:
+            time.sleep(self.latency)
+        response = requests.Response()
+        response.url = url
+        try:
+            with open(self._path(url), 'rb') as f:
+                recording = pickle.load(f)
+        except FileNotFoundError:
+            recording = None
+        if recording is None or recording['url'] != url:
+            response.status_code = 404
+            response.reason = 'Not Recorded'
+            response._content = b''
+            response._content_consumed = True
+            return response
+        response.status_code = recording['status_code']
+        response.reason = recording['reason']
+        response.headers = CaseInsensitiveDict(recording['headers'])
+        response.encoding = recording['encoding']
+        response._content = recording['content']
+        response._content_consumed = True
+        return response
@@ -0,0 +1,72 @@
+################################################################################
+#
+#   Clock
+#
+#   - Single place where RetroFeed asks what time it is, or waits for time to
+#     pass.  The Display (via its pacers) and the segments all go through the
+#     functions at the bottom of this module rather than calling
+#     datetime.now(), time.sleep(), etc. directly.
+#   - Normally that's just the real clock.  In headless mode, retrofeed.py
+#     swaps in a VirtualClock, where "sleeping" simply moves the clock
+#     forward.  A whole playlist cycle can then be rendered in next to no
+#     time, while still knowing how long it *would* have taken on a real
+#     display.
+#
+################################################################################
+
+import datetime as dt
+import threading
+import time
+
+
+class RealClock:
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def now(self):
+        return dt.datetime.now()
+
+
+class VirtualClock:
+
+    def __init__(self, start=None):
+        # Local date/time the virtual clock starts at (default is right now)
+        if start is None:
+            start = dt.datetime.now()
+        self._start = start
+        self._elapsed = 0.0
+        self._lock = threading.Lock()
+
+    def monotonic(self):
+        return self._elapsed
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            with self._lock:
+                self._elapsed += seconds
+
+    def now(self):
+        return self._start + dt.timedelta(seconds=self._elapsed)
+
+
+
+# The clock everyone is currently using
+_clock = RealClock()
+
+
+def use(clock):
+    global _clock
+    _clock = clock
+
+def monotonic():
+    return _clock.monotonic()
+
+def sleep(seconds):
+    _clock.sleep(seconds)
+
+def now():
+    return _clock.now()
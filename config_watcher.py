@@ -0,0 +1,53 @@
+################################################################################
+#
+#   ConfigWatcher Class
+#
+#   - Keeps an eye on the config file, so changes to it can be picked up
+#     without restarting RetroFeed (and losing everything the segments have
+#     fetched)
+#   - Changes only get applied between segments anyway, so check() is just
+#     called then, and looks at the file's modification time and size.
+#     Nothing needs to run in the background.
+#   - A file that doesn't load (a half-saved edit, a typo in the TOML) is
+#     ignored, and the last good config stays in effect.  It's tried again
+#     the next time the file changes.
+#
+################################################################################
+
+import os
+
+
+class ConfigWatcher:
+
+    def __init__(self, path, load):
+        # load() reads the file and returns the config, or raises an
+        # exception if it isn't usable
+        self.path = path
+        self.load = load
+        self._stamp = self._get_stamp()
+        # What was wrong with the file the last time it changed, if anything
+        self.error = None
+
+
+    def _get_stamp(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+    # Returns the new config if the file has changed since the last check,
+    # otherwise None
+    def check(self):
+        stamp = self._get_stamp()
+        if stamp is None or stamp == self._stamp:
+            return None
+        self._stamp = stamp
+        try:
+            config = self.load()
+        except Exception as e:
+            self.error = e
+            return None
+        self.error = None
+        return config
@@ -4,33 +4,86 @@
 #
 #   - Stores configured display settings (print speeds, verbosity, etc.)
 #   - Provides various printing and text processing functions to segments
+#   - Sends everything it prints to one or more output "sinks" (see sinks.py),
+#     so a single feed can drive several screens at once
 #
 #   Every segment should accept a Display object at initialization and use its
 #   functions for all text display, including linefeeds, headers, update
 #   messages, and pauses ("beats") within the segment.
 #
+#   Only one thread prints at a time.  A thread that's been abandoned by the
+#   watchdog (see watchdog.py) isn't allowed to print anything more.
+#
 ################################################################################
 
-import random
-import textwrap
-import time
+import threading
+
+import clock
+from pacing import play
+from sinks import Sink
+from transliterate import Transliterator
+from watchdog import Abandoned
 
 
 class Display:
     
     def __init__(self, display_settings):
-        # Use sensible defaults if any of the keys are missing
-        self._height = display_settings.get('height', 24)
-        self._width = display_settings.get('width', 40)
-        self._cps = display_settings.get('cps', 20)
+        self._sinks = []
+        self._configure(display_settings)
+        # Pacing steps for each sink are saved here while recording
+        self._recording = None
+        self._recording_thread = None
+        # Threads that aren't allowed to print anymore
+        self._play_lock = threading.Lock()
+        self._abandoned = set()
+        # Running statistics (see metrics.py), if they're turned on, and the
+        # key of the segment that's showing, to file them under
+        self.metrics = None
+        self.metrics_segment = None
+
+    def _configure(self, display_settings):
+        # Set up each output sink.  With no sinks listed, just use standard
+        # output with the main display settings.
+        sink_list = display_settings.get('sinks', [{'type':'stdout'}])
+        if len(sink_list) == 0:
+            raise RuntimeError('At least one display sink is required')
+        # Open everything new before letting go of anything old, and if any
+        # of it fails, close whatever did get opened
+        sinks = []
+        try:
+            for sink_settings in sink_list:
+                sinks.append(Sink(sink_settings, display_settings))
+            # Any extra character substitutions for clean_chars()
+            transliterator = Transliterator(display_settings.get('char_map', None))
+        except Exception:
+            for sink in sinks:
+                sink.close()
+            raise
+        for sink in self._sinks:
+            sink.close()
+        self._sinks = sinks
+        # Size and speed properties are those of the first (main) sink
+        main_sink = self._sinks[0]
+        self._height = main_sink.height
+        self._width = main_sink.width
+        self._cps = main_sink.cps
         self._print_delay = 1/self._cps
-        self._newline_cps = display_settings.get('newline_cps', 100)
+        self._newline_cps = main_sink.newline_cps
         self._newline_delay = 1/self._newline_cps
+        # Use sensible defaults if any of the keys are missing
         self._beat_delay = display_settings.get('beat_seconds', 1)
-        self._force_uppercase = display_settings.get('force_uppercase', True)
+        self._force_uppercase = main_sink.force_uppercase
         self._verbose_updates = display_settings.get('verbose_updates', True)
         self._prefer_24hr_time = display_settings.get('prefer_24hr_time', True)
-        
+        self._transliterator = transliterator
+
+    # Switch over to new settings (after the config file has been changed),
+    # once anything being printed right now is done.  Recordings made with
+    # the old sinks won't replay anymore, so segments will show afresh.
+    def reconfigure(self, display_settings):
+        with self._play_lock:
+            self._configure(display_settings)
+
     # Getters, but no setters (to hopefully keep other code from altering display values)
     @property
     def height(self):
@@ -95,60 +148,105 @@ class Display:
         
 ########  Printing methods  ###################################################
 
+    # Send the same output to every sink at once.  The passed function should
+    # take a sink and return the list of pacing steps to be played on it.
+    def _play_all(self, steps_for):
+        jobs = [(sink, steps_for(sink)) for sink in self._sinks]
+        with self._play_lock:
+            self._check_abandoned()
+            if self._recording is not None:
+                for i, (sink, steps) in enumerate(jobs):
+                    self._recording[i][1].extend(steps)
+            self._play([(sink.pacer, steps) for sink, steps in jobs])
+
+    # Play, keeping track of the time taken and the characters typed on the
+    # main sink.  Called with the play lock held.
+    def _play(self, jobs):
+        if self.metrics is None:
+            play(jobs)
+            return
+        start = clock.monotonic()
+        play(jobs)
+        labels = (self.metrics_segment or 'other',)
+        self.metrics.count('retrofeed_typing_seconds_total', labels, clock.monotonic() - start)
+        chars = sum(len(text) for text, speed in jobs[0][1] if text is not None)
+        self.metrics.count('retrofeed_typed_characters_total', labels, chars)
+
+    # Cut off any more printing from the passed thread (one the watchdog has
+    # given up on).  Waits for anything it's printing right now to finish.
+    # Threads are kept track of by the Thread objects themselves, since a
+    # finished thread's ident can be handed right out again to a new one.
+    def abandon(self, thread):
+        with self._play_lock:
+            # Forget any that have finished on their own without printing
+            self._abandoned = {t for t in self._abandoned if t.is_alive()}
+            self._abandoned.add(thread)
+            if self._recording_thread == thread.ident:
+                self._recording = None
+                self._recording_thread = None
+
+    # Called with the play lock held
+    def _check_abandoned(self):
+        if len(self._abandoned) > 0:
+            thread = threading.current_thread()
+            if thread in self._abandoned:
+                self._abandoned.discard(thread)
+                raise Abandoned()
+
+    # Start saving everything that gets printed, all laid out and ready to be
+    # played back later with replay()
+    def start_recording(self):
+        self._recording = [(sink, []) for sink in self._sinks]
+        self._recording_thread = threading.get_ident()
+
+    # Stop recording and return what was recorded (or None, if the recording
+    # was started by some other thread)
+    def stop_recording(self):
+        if self._recording_thread != threading.get_ident():
+            return None
+        frame = self._recording
+        self._recording = None
+        self._recording_thread = None
+        return frame
+
+    # Play back a recording from start/stop_recording().  Returns False (and
+    # does nothing) if the recording doesn't match our current sinks.
+    def replay(self, frame):
+        if frame is None or [sink for sink, steps in frame] != self._sinks:
+            return False
+        with self._play_lock:
+            self._check_abandoned()
+            if self._recording is not None:
+                for i, (sink, steps) in enumerate(frame):
+                    self._recording[i][1].extend(steps)
+            self._play([(sink.pacer, steps) for sink, steps in frame])
+        return True
+
     # Wait for n "beats" (default = 1).  Used below--available to segments too
     # Length of one beat is defined at configuration
     def wait_beats(self, n=1):
         if n < 0:
             n = 1
-        for i in range(n):
-            time.sleep(self.beat_delay)
+        self._play_all(lambda sink: [(None, n * self.beat_delay)])
 
     # Slooow version of print()
     # Passed strings should usually be mixed case to give the user the option
     # to see them that way if they conifg force_uppercase to be false
+    # Each sink wraps the string to its own width, if needed
     def print(self, s='', end='\n'):
-        # Use wrapping if string is longer than display width
-        if len(s) > self.width:
-            lines = textwrap.wrap(s, self.width)
-            for line in lines:
-                # Oooh... recursion!
-                self.print(line, end=end)
-            return
-        for c in s:
-            if self._force_uppercase:
-                c = c.upper()
-            print(c, end='', flush=True)
-            time.sleep(self.print_delay) 
-        print(end, end='', flush=True)
-        time.sleep(self.print_delay)
+        self._play_all(lambda sink: sink.print_steps(s, end))
 
     # Slooow Newline - Print n spaces with pause for an extra "delay"
     # seconds at some random horizontal point
     def newline(self, delay=None):
-        # Pick a random position to pause to avoid(?) screen burn-in
-        pause_pos = random.randrange(self.width)
-        for i in range(self.width):
-            print(' ', end='', flush=True)
-            time.sleep(self.newline_delay)
-            if i == pause_pos and delay is not None:
-                time.sleep(delay)
-        print(flush=True)
-        time.sleep(self.newline_delay)
+        self._play_all(lambda sink: sink.newline_steps(delay))
 
     # Display the passed string as a segment header, surrounded by markers
     def print_header(self, s, left_marker=' ', right_marker=None):
         if right_marker is None:
             right_marker = left_marker
         s = s.strip()
-        if self.force_uppercase:
-            s = s.upper()
-        num_markers = 0
-        if len(s) + 4 < self.width:
-            num_markers = int((self.width - 4 - len(s)) / 2)
-        self.print(left_marker * num_markers, end='')
-        self.print('  ' + s + '  ', end='')
-        self.print(right_marker * num_markers, end='')
-        self.print()
+        self._play_all(lambda sink: sink.header_steps(s, left_marker, right_marker))
 
     # Display passed string as an "updating..." message
     def print_update_msg(self, m):
@@ -193,46 +291,8 @@ class Display:
 
     # Substitute some unicode characters, remove others
     # This also removes returns and strips whitespace at ends
-    @classmethod
-    def clean_chars(cls, s):
-        new_s = ''
-        for c in s:
-            u = ord(c)
-            # Tab = four spaces
-            if u == 9:
-                new_s += '    '
-                continue
-            # Fancy puncuation and other special characters
-            if u >= 0x2013:
-                # Various dashes
-                if 0x2013 <= u <= 0x2017:
-                    new_s += '-'
-                # Double quotes
-                elif u == 0x201C or u == 0x201D:
-                    new_s += '"'
-                # Single quotes
-                elif u == 0x2018 or u == 0x2019:
-                    new_s += "'"
-                # Bullet
-                elif u == 0x2022:
-                    new_s += "*"
-                # Ellipsis...
-                elif u == 0x2026:
-                    new_s += '...'
-                # Copyright and Reg Trmk
-                elif u == 0x00A9:
-                    new_s += '(c)'
-                elif u == 0x00AE:
-                    new_s += '(R)'
-                # Capital and lowercase tilde-n
-                elif u == 0x00D1:
-                    news_s += 'N'
-                elif u == 0x00F1:
-                    news_s += 'n'
-            # Any old-school ASCII may pass
-            elif (32 <= u <= 126):
-                new_s += c   
-        return new_s.strip()
+    def clean_chars(self, s):
+        return self._transliterator.clean(s)
     
 
     # Pulls out a few HTML tags
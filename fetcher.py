@@ -0,0 +1,218 @@
+################################################################################
+#
+#   Fetcher Class
+#
+#   - The one place segments' web requests go through (via SegmentParent's
+#     get_soup() and fetch() methods), so they can all share one pooled
+#     HTTP session
+#   - Connections are kept alive and reused, per host, so back-to-back
+#     requests to the same site (like AP's burst of story pages) don't each
+#     pay for a fresh DNS lookup, TCP connection, and TLS handshake
+#   - Pool sizes and the retry policy come from the optional [network]
+#     section of the config file
+#   - Keeps count of requests made and connections opened for each host, so
+#     we can see how often connections actually get reused
+#   - Optionally keeps pages in an on-disk cache (see http_cache.py), and only
+#     downloads them again when they've changed.  Each response gets a
+#     cache_status attribute telling how it went:
+#       'hit'          Served from the cache, without asking the server
+#       'revalidated'  Server said our copy was still good (a 304)
+#       'miss'         Downloaded in full
+#       None           Not cacheable, or no cache
+#     along with a cache_version, which stays the same for as long as the
+#     page's content does
+#   - Can also record all responses to, or play them back from, a Cassette
+#     (see cassette.py) instead of going out to the network
+#   - Has a "circuit breaker" for each host:  After several failures in a
+#     row (can't connect, or server errors), requests to that host fail right
+#     away with CircuitOpen for a while, instead of each one waiting to time
+#     out.  Then one request is let through to see if the host is back.  If
+#     it isn't, the wait doubles (up to a limit).
+#
+################################################################################
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.retry import Retry
+
+from http_cache import HttpCache
+
+
+# Raised instead of making a request to a host that's been failing
+class CircuitOpen(requests.exceptions.ConnectionError):
+    pass
+
+
+class Fetcher:
+
+    def __init__(self, network_settings=None):
+        if network_settings is None:
+            network_settings = {}
+        # Number of different hosts to keep connection pools for, and the
+        # number of connections to keep open to each one
+        pool_hosts = network_settings.get('pool_hosts', 10)
+        pool_size = network_settings.get('pool_size', 4)
+        # Retry failed connections and certain "try again later" responses
+        retry = Retry(total=network_settings.get('retries', 2),
+                      backoff_factor=network_settings.get('retry_backoff', 0.5),
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=['GET', 'HEAD'],
+                      raise_on_status=False)
+        self._adapter = HTTPAdapter(pool_connections=pool_hosts,
+                                    pool_maxsize=pool_size,
+                                    max_retries=retry)
+        self._session = requests.Session()
+        self._session.mount('https://', self._adapter)
+        self._session.mount('http://', self._adapter)
+        # Counts by host:  {host: {'requests':n, 'connections':n}}
+        self._stats = {}
+        # Last-seen totals from each host's connection pool
+        self._pool_counts = {}
+        self._lock = threading.Lock()
+        # Optional on-disk cache of pages
+        self.cache = None
+        if 'cache_dir' in network_settings:
+            max_bytes = int(network_settings.get('cache_max_mb', 50) * 1024 * 1024)
+            self.cache = HttpCache(network_settings['cache_dir'], max_bytes)
+        # Optional Cassette to record to or play back from
+        self.cassette = None
+        # Circuit breaker settings, and the state of each host's circuit:
+        #   {host: {'failures':n, 'opens':n, 'open_until':t}}
+        self.breaker_failures = network_settings.get('breaker_failures', 3)
+        self.breaker_seconds = network_settings.get('breaker_seconds', 60)
+        self.breaker_max_seconds = network_settings.get('breaker_max_seconds', 30 * 60)
+        self._circuits = {}
+
+
+    # Returns a requests Response object for the passed url
+    def get(self, url, headers=None, **kwargs):
+        if self.cache is None:
+            return self._get(url, headers, **kwargs)
+        entry = self.cache.load(url)
+        if entry is not None and entry['fresh_until'] is not None and time.time() < entry['fresh_until']:
+            return self.cached_response(url, entry, 'hit')
+        headers = dict(headers or {})
+        if entry is not None:
+            if entry['etag'] is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified'] is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+        response = self._get(url, headers, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.refresh(url, entry, response)
+            return self.cached_response(url, entry, 'revalidated')
+        if response.status_code == 200:
+            entry = self.cache.store(url, response)
+            if entry is not None:
+                response.cache_status = 'miss'
+                response.cache_version = entry['stored_at']
+        return response
+
+
+    # Returns a requests Response object for the url without reading the body
+    # yet, so it can be read a piece at a time with iter_content().  This
+    # skips the page cache, since maybe only part of the page will ever get
+    # read.  Be sure to close() it when done.
+    def get_stream(self, url, headers=None, **kwargs):
+        return self._get(url, headers, stream=True, **kwargs)
+
+
+    def _get(self, url, headers, **kwargs):
+        if self.cassette is not None and self.cassette.mode == 'replay':
+            response = self.cassette.replay(url)
+        else:
+            host = urlsplit(url).netloc
+            self._check_circuit(host)
+            try:
+                response = self._session.get(url, headers=headers, **kwargs)
+            except requests.exceptions.RequestException:
+                self._host_failed(host)
+                raise
+            if response.status_code >= 500:
+                self._host_failed(host)
+            else:
+                self._host_ok(host)
+            self._count(url)
+            if self.cassette is not None:
+                self.cassette.record(url, response)
+        response.cache_status = None
+        response.cache_version = None
+        return response
+
+
+    # Raises CircuitOpen if the host's circuit is open.  Once it's been open
+    # long enough, lets one request through (holding everyone else off until
+    # that one's done) to try the host again.
+    def _check_circuit(self, host):
+        with self._lock:
+            circuit = self._circuits.get(host)
+            if circuit is None or circuit['failures'] < self.breaker_failures:
+                return
+            now = time.monotonic()
+            if now < circuit['open_until']:
+                raise CircuitOpen(f'Giving {host} a rest after {circuit["failures"]} failures')
+            circuit['open_until'] = now + self.breaker_seconds
+
+
+    def _host_failed(self, host):
+        with self._lock:
+            circuit = self._circuits.setdefault(host, {'failures':0, 'opens':0, 'open_until':0})
+            circuit['failures'] += 1
+            if circuit['failures'] >= self.breaker_failures:
+                wait = self.breaker_seconds * 2 ** min(circuit['opens'], 16)
+                circuit['open_until'] = time.monotonic() + min(wait, self.breaker_max_seconds)
+                circuit['opens'] += 1
+
+
+    def _host_ok(self, host):
+        with self._lock:
+            self._circuits.pop(host, None)
+
+
+    # Builds a Response object out of a cache entry
+    def cached_response(self, url, entry, cache_status):
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = entry['encoding']
+        response._content = entry['content']
+        response._content_consumed = True
+        response.cache_status = cache_status
+        response.cache_version = entry['stored_at']
+        return response
+
+
+    # Update the request/connection counts for the url's host, based on
+    # what its connection pools say they've been up to
+    def _count(self, url):
+        parts = urlsplit(url)
+        host = parts.netloc
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        pools = self._adapter.poolmanager.pools
+        with self._lock:
+            stats = self._stats.setdefault(host, {'requests':0, 'connections':0})
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None or (pool.host, pool.port) != (parts.hostname, port):
+                    continue
+                last_requests, last_connections = self._pool_counts.get(id(pool), (0, 0))
+                self._pool_counts[id(pool)] = (pool.num_requests, pool.num_connections)
+                stats['requests'] += pool.num_requests - last_requests
+                stats['connections'] += pool.num_connections - last_connections
+
+
+    # Returns a copy of the counts, by host, including how many requests went
+    # over an already-open connection
+    def stats(self):
+        with self._lock:
+            stats = {}
+            for host, counts in self._stats.items():
+                stats[host] = dict(counts)
+                stats[host]['reused'] = max(counts['requests'] - counts['connections'], 0)
+            return stats
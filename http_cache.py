@@ -0,0 +1,180 @@
+################################################################################
+#
+#   HttpCache Class
+#
+#   - Keeps copies of downloaded pages on disk, along with the ETag and
+#     Last-Modified headers the server sent with them
+#   - The Fetcher uses those to make "conditional" requests:  the server only
+#     sends the page again if it has changed.  If it hasn't, we get a short
+#     304 ("Not Modified") response and use the copy we already have.
+#   - If the server said a page is good for a while (Cache-Control max-age,
+#     or Expires), the copy is just used, without asking the server at all
+#   - The total size of the cache is kept under a limit, throwing out the
+#     least-recently-used pages first
+#   - Turned on by setting cache_dir in the [network] section of the config
+#
+#   Each page is stored as a pickled dictionary, in a file named after a hash
+#   of its url.  Files are written to a temporary name and then renamed, so a
+#   crash never leaves a half-written page behind.
+#
+################################################################################
+
+import email.utils
+import hashlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+
+class HttpCache:
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        # File sizes by name, from least- to most-recently used
+        self._files = OrderedDict()
+        self._total_bytes = 0
+        entries = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith('.tmp'):
+                # Left over from a crash
+                os.remove(path)
+            elif name.endswith('.page'):
+                st = os.stat(path)
+                entries.append((st.st_mtime, name, st.st_size))
+        for mtime, name, size in sorted(entries):
+            self._files[name] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict()
+
+
+    def _file_name(self, url):
+        return hashlib.sha1(url.encode()).hexdigest() + '.page'
+
+
+    # Returns the stored entry for the url, or None
+    def load(self, url):
+        name = self._file_name(url)
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+        path = os.path.join(self.cache_dir, name)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            # Remember the use on disk too, for the next time we start up
+            os.utime(path)
+        except Exception:
+            self.remove(url)
+            return None
+        # Just in case two urls ever hash the same
+        if entry.get('url') != url:
+            return None
+        return entry
+
+
+    # Saves a 200 response, if it has anything that would let us use it again
+    def store(self, url, response):
+        cache_control = parse_cache_control(response.headers.get('Cache-Control', ''))
+        if 'no-store' in cache_control:
+            return None
+        entry = {'url':url,
+                 'stored_at':time.time(),
+                 'etag':response.headers.get('ETag'),
+                 'last_modified':response.headers.get('Last-Modified'),
+                 'fresh_until':fresh_until(response.headers, cache_control),
+                 'headers':dict(response.headers),
+                 'encoding':response.encoding,
+                 'content':response.content,
+                }
+        if entry['etag'] is None and entry['last_modified'] is None and entry['fresh_until'] is None:
+            return None
+        self._write(url, entry)
+        return entry
+
+
+    # Updates a stored entry after the server says it hasn't changed
+    def refresh(self, url, entry, response):
+        cache_control = parse_cache_control(response.headers.get('Cache-Control', ''))
+        entry['fresh_until'] = fresh_until(response.headers, cache_control)
+        entry['etag'] = response.headers.get('ETag', entry['etag'])
+        entry['last_modified'] = response.headers.get('Last-Modified', entry['last_modified'])
+        self._write(url, entry)
+
+
+    def remove(self, url):
+        name = self._file_name(url)
+        with self._lock:
+            size = self._files.pop(name, None)
+            if size is not None:
+                self._total_bytes -= size
+                self._delete(name)
+
+
+    def _write(self, url, entry):
+        name = self._file_name(url)
+        path = os.path.join(self.cache_dir, name)
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            os.replace(tmp_path, path)
+            self._total_bytes += size - self._files.pop(name, 0)
+            self._files[name] = size
+            self._evict()
+
+
+    # Throw out least-recently-used pages until we're under the size limit.
+    # Called with the lock held.
+    def _evict(self):
+        while self._total_bytes > self.max_bytes and len(self._files) > 0:
+            name, size = self._files.popitem(last=False)
+            self._total_bytes -= size
+            self._delete(name)
+
+
+    def _delete(self, name):
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except FileNotFoundError:
+            pass
+
+
+# Returns a dictionary of Cache-Control directives, like {'max-age':'60'}
+def parse_cache_control(value):
+    directives = {}
+    for part in value.split(','):
+        key, _, arg = part.strip().partition('=')
+        if key != '':
+            directives[key.lower()] = arg.strip('"')
+    return directives
+
+
+# Returns the time (as a timestamp) until which a response can be used
+# without checking back with the server, or None
+def fresh_until(headers, cache_control):
+    if 'no-cache' in cache_control:
+        return None
+    if 'max-age' in cache_control:
+        try:
+            max_age = int(cache_control['max-age'])
+        except ValueError:
+            return None
+        age = headers.get('Age', '0')
+        age = int(age) if age.isdigit() else 0
+        return time.time() + max_age - age
+    if 'Expires' in headers:
+        try:
+            expires = email.utils.parsedate_to_datetime(headers['Expires'])
+            return expires.timestamp()
+        except (TypeError, ValueError):
+            return None
+    return None
@@ -0,0 +1,164 @@
+################################################################################
+#
+#   Metrics Class
+#
+#   - Keeps running statistics on how each segment is doing:  how long its
+#     web requests take and what comes back, how long parsing, refreshing
+#     and showing take, how the page cache is doing, and how old its data is
+#   - Served up over HTTP in the Prometheus text format, for a monitoring
+#     system (or just a web browser) to look at
+#   - Turned on by the optional [metrics] section of the config file:
+#
+#       port    Port to serve the statistics on (default 9108), at /metrics
+#       host    Address to listen on (default '127.0.0.1', this computer
+#               only.  Use '0.0.0.0' to allow access from anywhere.)
+#
+#   When it's turned off, there's no Metrics object at all, and the places
+#   that would record something (in SegmentParent and Display) just skip it.
+#
+#   Everything that can be recorded is listed in METRICS below.  Counters
+#   only go up, histograms count how many observations fell into each range
+#   ("bucket") of values, and gauges are worked out fresh, by a function,
+#   whenever the statistics are asked for.
+#
+################################################################################
+
+import threading
+
+
+SECONDS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SHOW_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600)
+
+# name: (type, help, label names, histogram buckets)
+METRICS = {
+    'retrofeed_fetch_seconds':
+        ('histogram', 'Time taken by web requests', ('segment',), SECONDS_BUCKETS),
+    'retrofeed_http_responses_total':
+        ('counter', 'Web responses, by HTTP status code', ('segment', 'status'), None),
+    'retrofeed_fetch_errors_total':
+        ('counter', 'Web requests that got no response at all', ('segment',), None),
+    'retrofeed_downloaded_bytes_total':
+        ('counter', 'Bytes of page content downloaded (not counting cached pages)', ('segment',), None),
+    'retrofeed_cache_requests_total':
+        ('counter', 'Web requests, by how they went with the page cache', ('segment', 'result'), None),
+    'retrofeed_parse_seconds':
+        ('histogram', 'Time taken parsing HTML', ('segment',), SECONDS_BUCKETS),
+    'retrofeed_refresh_seconds':
+        ('histogram', 'Time taken by data refreshes, fetching and parsing included', ('segment',), SECONDS_BUCKETS),
+    'retrofeed_refresh_failures_total':
+        ('counter', 'Data refreshes that failed or ran over their time limit', ('segment',), None),
+    'retrofeed_show_seconds':
+        ('histogram', 'Time taken showing the segment', ('segment',), SHOW_BUCKETS),
+    'retrofeed_typing_seconds_total':
+        ('counter', 'Time spent typing out text and pausing on the display', ('segment',), None),
+    'retrofeed_typed_characters_total':
+        ('counter', 'Characters typed out on the main display', ('segment',), None),
+    'retrofeed_data_age_seconds':
+        ('gauge', 'Time since the data was last refreshed', ('segment',), None),
+}
+
+
+class Metrics:
+
+    def __init__(self):
+        # Values for each metric, by label values.  A counter's value is a
+        # number, and a histogram's is a list of the count in each bucket,
+        # then the sum and the count of all observations.
+        self._values = {name:{} for name in METRICS}
+        # Functions that return a gauge's values, as {label values: value}
+        self._gauges = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+
+    # Adds to a counter.  Labels are given as a tuple of values, in the same
+    # order as their names in METRICS.
+    def count(self, name, labels, amount=1):
+        values = self._values[name]
+        with self._lock:
+            values[labels] = values.get(labels, 0) + amount
+
+
+    # Adds an observation to a histogram
+    def observe(self, name, labels, value):
+        buckets = METRICS[name][3]
+        values = self._values[name]
+        with self._lock:
+            counts = values.get(labels)
+            if counts is None:
+                counts = [0] * (len(buckets) + 2)
+                values[labels] = counts
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+
+    def set_gauge(self, name, fn):
+        self._gauges[name] = fn
+
+
+    # Returns everything, in the Prometheus text format
+    def render(self):
+        lines = []
+        for name, (kind, help, label_names, buckets) in METRICS.items():
+            if kind == 'gauge':
+                fn = self._gauges.get(name)
+                values = fn() if fn is not None else {}
+            else:
+                with self._lock:
+                    values = {labels:(list(v) if kind == 'histogram' else v)
+                              for labels, v in self._values[name].items()}
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(values.items()):
+                pairs = list(zip(label_names, labels))
+                if kind != 'histogram':
+                    lines.append(f'{name}{self.format_labels(pairs)} {value}')
+                    continue
+                for bound, count in zip(buckets + ('+Inf',), value[:-2] + [value[-1]]):
+                    lines.append(f'{name}_bucket{self.format_labels(pairs + [("le", bound)])} {count}')
+                lines.append(f'{name}_sum{self.format_labels(pairs)} {value[-2]}')
+                lines.append(f'{name}_count{self.format_labels(pairs)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+    @classmethod
+    def format_labels(cls, pairs):
+        if len(pairs) == 0:
+            return ''
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in pairs) + '}'
+
+
+    # Starts serving the statistics at http://host:port/metrics, in a
+    # background thread
+    def serve(self, metrics_settings):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                # Keep request logging off the screen
+                pass
+
+        address = (metrics_settings.get('host', '127.0.0.1'), metrics_settings.get('port', 9108))
+        try:
+            self._server = ThreadingHTTPServer(address, Handler)
+        except OSError as e:
+            raise RuntimeError(f'Can\'t serve metrics on {address[0]}:{address[1]} ({e})')
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
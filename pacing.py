@@ -0,0 +1,195 @@
+################################################################################
+#
+#   Pacer Class
+#
+#   - Sends text to an output file descriptor at a fixed characters-per-second
+#     rate, for that old-timey "slow terminal" look
+#   - Works against a schedule of deadlines on the monotonic clock rather than
+#     sleeping a fixed amount after each character.  Time spent writing, or
+#     time lost to the OS waking us up late, is made up on the next character
+#     instead of quietly piling up, so a long run averages out to the exact
+#     configured speed.
+#   - If we fall behind schedule, every character that's already due goes out
+#     in a single write, so there's at most one write (and one sleep) per
+#     character, and often fewer
+#
+#   Each output has its own Pacer, and so its own schedule.  The play()
+#   function below runs any number of them side-by-side from a single thread,
+#   always sleeping until whichever one is due next.
+#
+#   Outputs that can push back (a serial line that's been sent an XOFF, say)
+#   are opened non-blocking.  Anything they won't take yet is held onto, and
+#   play() waits for them to become writable with select() rather than
+#   spinning, while still keeping any other outputs on schedule.
+#
+#   Used by the Display class.  Segments shouldn't need to touch this.
+#
+################################################################################
+
+import os
+import select
+import sys
+
+import clock
+
+
+class Pacer:
+
+    def __init__(self, fd=None, max_lag=0.25, bulk_cps=None, encode=None):
+        # File descriptor to write to (standard output by default)
+        if fd is None:
+            fd = sys.stdout.fileno()
+        self.fd = fd
+        # If the output has its own fixed speed (like a serial line), any
+        # text asked to go at that speed or faster is just written all at
+        # once, and the output itself does the pacing
+        self.bulk_cps = bulk_cps
+        # Optional function to turn text into the bytes actually sent
+        # (see screen.py).  Otherwise, the text is just sent as-is.
+        self.encode = encode
+        # How far behind schedule we're willing to be and still "catch up".
+        # Anything later than this (after a long network fetch, say) just
+        # restarts the schedule from the current time, so we don't spew out
+        # a burst of text all at once.
+        self.max_lag = max_lag
+        # Monotonic time at which the next character is due to go out
+        self._next = clock.monotonic()
+        # Steps still to be carried out.  Each is a tuple of either:
+        #    (text, cps)      Type out the text at the given speed
+        #    (None, seconds)  Pause for the given number of seconds
+        self._steps = []
+        self._pos = 0
+        # Set while we're waiting out a pause that has nothing after it
+        self._holding = False
+        # Bytes that are due, but that the output isn't ready to take yet
+        self._pending = b''
+
+
+    # Bring the schedule up to the present if we've been idle for a while
+    def _resync(self, now):
+        if self._next < now - self.max_lag:
+            self._next = now
+
+
+    # Write as much of the passed bytes (and anything left over from before)
+    # as the output will take right now
+    def _write(self, b=b''):
+        self._pending += b
+        while self._pending:
+            try:
+                written = os.write(self.fd, self._pending)
+            except BlockingIOError:
+                return
+            self._pending = self._pending[written:]
+
+
+    def _encode(self, text):
+        if self.encode is None:
+            return text.encode()
+        return self.encode(text)
+
+
+    # True if we're stuck waiting for the output to take more bytes
+    def is_blocked(self):
+        return len(self._pending) > 0
+
+
+    # Queue up a list of steps (see above) to be carried out by play()
+    def load(self, steps):
+        if len(self._steps) == 0:
+            self._resync(clock.monotonic())
+        self._steps.extend(steps)
+
+
+    # Monotonic time at which there's next something to do, or None if done
+    # (or if we can't do anything until the output is writable again)
+    def next_due(self):
+        if self.is_blocked():
+            return None
+        if len(self._steps) > 0 or self._holding:
+            return self._next
+        return None
+
+
+    # True if there's nothing left to do at all
+    def is_finished(self):
+        return len(self._steps) == 0 and not self._holding and not self.is_blocked()
+
+
+    # Carry out whatever is due as of monotonic time "now"
+    def advance(self, now):
+        if self.is_blocked():
+            self._write()
+            if self.is_blocked():
+                return
+            # If we were held up for long, don't try to make up for it
+            self._resync(now)
+        if self._holding and now >= self._next:
+            self._holding = False
+        while len(self._steps) > 0 and not self.is_blocked():
+            text, arg = self._steps[0]
+            if text is None:
+                # Pauses just push the schedule back
+                self._next += arg
+                self._steps.pop(0)
+                self._holding = len(self._steps) == 0
+                continue
+            if self._next > now:
+                return
+            if self.bulk_cps is not None and arg >= self.bulk_cps:
+                # Send the rest of it, and let the output take its time,
+                # which depends on how many bytes actually go down the line
+                b = self._encode(text[self._pos:])
+                self._pos = len(text)
+                self._next += len(b) / self.bulk_cps
+            else:
+                # How many characters are due by now?  (Always at least one.)
+                interval = 1 / arg
+                due = int((now - self._next) / interval) + 1
+                due = min(due, len(text) - self._pos)
+                b = self._encode(text[self._pos:self._pos+due])
+                self._pos += due
+                self._next += due * interval
+            if b:
+                self._write(b)
+            if self._pos >= len(text):
+                self._steps.pop(0)
+                self._pos = 0
+
+
+    # Send text out one character every 1/cps seconds
+    def type(self, text, cps):
+        play([(self, [(text, cps)])])
+
+
+    # Hold off on any more output for the given number of seconds
+    def pause(self, seconds):
+        play([(self, [(None, seconds)])])
+
+
+
+# Carries out each Pacer's list of steps, interleaving them all according to
+# their own schedules.  Returns once every one of them is finished.
+def play(jobs):
+    pacers = []
+    for pacer, steps in jobs:
+        steps = [step for step in steps if step[0] != '' and step[1] > 0]
+        pacer.load(steps)
+        pacers.append(pacer)
+    # Anything still sitting in Python's own stdout buffer needs to go
+    # out first, since we're going around it
+    sys.stdout.flush()
+    while not all(p.is_finished() for p in pacers):
+        due_times = [p.next_due() for p in pacers]
+        due_times = [t for t in due_times if t is not None]
+        blocked_fds = [p.fd for p in pacers if p.is_blocked()]
+        now = clock.monotonic()
+        wait = max(min(due_times) - now, 0) if len(due_times) > 0 else None
+        if len(blocked_fds) > 0:
+            # Sleep until something is due or a stuck output frees up
+            select.select([], blocked_fds, [], wait)
+        elif wait is not None and wait > 0:
+            clock.sleep(wait)
+        now = clock.monotonic()
+        for pacer in pacers:
+            pacer.advance(now)
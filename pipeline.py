@@ -0,0 +1,86 @@
+################################################################################
+#
+#   Pipeline Class
+#
+#   - Splits the main loop into two halves, joined by a small queue:
+#       * A "producer" thread walks the playlist a step or two ahead of the
+#         screen, making sure each upcoming segment has fresh data (which is
+#         usually where the slow network fetching happens)
+#       * The main thread is the "consumer," taking segments off the queue and
+#         showing them
+#   - The upshot is that a segment's refresh happens while the previous
+#     segment is still being typed out, instead of leaving the screen sitting
+#     on an "updating..." message
+#   - The queue is bounded, so the producer never gets more than a couple of
+#     segments ahead of what's on screen
+#   - If anything goes wrong in the producer, the error is passed along the
+#     queue, for next() to raise in the main thread, and the producer carries
+#     on with the following entry
+#   - To switch to a new playlist, stop() the old Pipeline and start a new one
+#
+################################################################################
+
+import queue
+import threading
+
+
+class Pipeline:
+
+    def __init__(self, segments, playlist, depth=1):
+        # Segments dictionary, and the Playlist that says which one's next
+        self.segments = segments
+        self.playlist = playlist
+        self._queue = queue.Queue(maxsize=max(depth, 1))
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+
+    # Producer:  Runs in its own thread, feeding the queue
+    def _produce(self):
+        while not self._stop.is_set():
+            try:
+                entry = self.playlist.next(self.segments)
+                if entry is None:
+                    break
+                seg_key = entry['key']
+                segment = None
+                if seg_key in self.segments:
+                    try:
+                        segment = self.segments[seg_key]
+                        segment.prepare()
+                    except Exception:
+                        # Never mind... show() will just try again itself
+                        pass
+                self.playlist.picked(entry, segment)
+                item = (seg_key, entry['format'])
+            except Exception as e:
+                # Let the consumer report it, rather than leaving it waiting
+                # on a producer that's gone
+                item = e
+            self._queue.put(item)
+        if self._stop.is_set():
+            return
+        # Let the consumer know we're all done
+        self._queue.put(None)
+
+
+    # Shuts down the producer.  Anything it had queued up is thrown away.
+    def stop(self):
+        self._stop.set()
+        # Make room, in case the producer is waiting to put something in
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+
+    # Consumer:  Returns the next (seg_key, seg_fmt) to show, or None when
+    # the playlist has been gone through the requested number of times.
+    # Raises whatever went wrong in the producer, if anything did.
+    def next(self):
+        item = self._queue.get()
+        if isinstance(item, Exception):
+            raise item
+        return item
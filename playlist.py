@@ -0,0 +1,259 @@
+################################################################################
+#
+#   Playlist Class
+#
+#   - Compiles the [playlist] section of the config into a ready-made
+#     schedule when it's loaded, and then picks which segment comes next
+#   - Each entry in the order list can be a plain segment key, a [key,
+#     {format}] pair, or a table with any of these extra options:
+#
+#       segment      The segment key (required)
+#       format       Format parameters for the showing, as in a [key, {format}]
+#                    pair
+#       hours        Only show during these hours, like '9:30-16:00' or
+#                    '6-10'.  Can wrap past midnight ('22-2').
+#       days         Only show on these days, like 'mon-fri', 'sat', or
+#                    ['sat', 'sun'].  With hours that wrap past midnight, the
+#                    day is the day it starts on.
+#       weight       Show this many times for each time through the rest of
+#                    the playlist, spread out as evenly as possible
+#                    (default 1)
+#       min_spacing  Minutes to wait after any showing of the same segment
+#                    before this entry can show it again (default 0)
+#       only_new     true/false.  If true, skip this entry when the segment's
+#                    data hasn't changed since this entry last showed it
+#                    (default false)
+#
+#   - At load time, the week is split into stretches where the same entries
+#     are in effect, and each stretch gets its own running order, with the
+#     weighted entries already spread out through it.  A table of which
+#     stretch each minute of the week belongs to means the current one can
+#     be looked up directly, so picking the next entry is just a matter of
+#     stepping along its running order (skipping any entries that aren't due
+#     yet or have nothing new).
+#   - If every entry in the running order would be skipped, the next one is
+#     shown anyway, so the feed never stalls
+#   - A plain list of keys and pairs, with no extra options, plays in order,
+#     exactly as written
+#   - Raises RuntimeError for anything in the playlist that doesn't make
+#     sense, including times of the week with nothing at all to show
+#
+################################################################################
+
+import clock
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+ENTRY_OPTIONS = ['segment', 'format', 'hours', 'days', 'weight', 'min_spacing', 'only_new']
+
+
+class Playlist:
+
+    def __init__(self, playlist_settings, cycles=None):
+        if 'order' not in playlist_settings:
+            raise RuntimeError('No order given in [playlist]')
+        if 'segment_pause' not in playlist_settings:
+            raise RuntimeError('No segment_pause given in [playlist]')
+        self.segment_pause = playlist_settings['segment_pause']
+        self.entries = [self.parse_entry(item) for item in playlist_settings['order']]
+        if len(self.entries) == 0:
+            raise RuntimeError('The playlist order is empty')
+        # Number of times left to go through the running order (None =
+        # forever)
+        self.cycles_left = cycles
+        # Running order (list of entry indexes) for each stretch of the week,
+        # and which stretch each minute of the week is in
+        self._orders = []
+        self._minutes = []
+        self._compile()
+        # Where we are in each running order
+        self._positions = [0] * len(self._orders)
+        # When (on clock.monotonic()) each segment key was last picked, and
+        # the segment's data version then, for each entry
+        self._picked_at = {}
+        self._versions = [None] * len(self.entries)
+
+
+    @classmethod
+    def parse_entry(cls, item):
+        # If the entry is just a plain-old string, use that as the key and
+        # assume no formatting.  If it's a list, use the first element as key
+        # and second element (if any) as format stuff.
+        entry = {'key':None, 'format':{}, 'windows':None, 'weight':1,
+                 'min_spacing':0, 'only_new':False}
+        if isinstance(item, str):
+            entry['key'] = item
+        elif isinstance(item, list) and len(item) > 0:
+            entry['key'] = item[0]
+            if len(item) > 1:
+                entry['format'] = item[1]
+        elif isinstance(item, dict):
+            unknown = [k for k in item if k not in ENTRY_OPTIONS]
+            if len(unknown) > 0:
+                raise RuntimeError(f'Unknown playlist option(s): {", ".join(unknown)}')
+            if 'segment' not in item:
+                raise RuntimeError('Playlist entry has no segment')
+            entry['key'] = item['segment']
+            entry['format'] = item.get('format', {})
+            if 'hours' in item or 'days' in item:
+                entry['windows'] = cls.parse_windows(item.get('hours', '0-24'), item.get('days', 'mon-sun'))
+            entry['weight'] = item.get('weight', 1)
+            if not isinstance(entry['weight'], int) or entry['weight'] < 1:
+                raise RuntimeError(f'Playlist weight for "{entry["key"]}" should be a whole number, 1 or more')
+            entry['min_spacing'] = item.get('min_spacing', 0)
+            entry['only_new'] = item.get('only_new', False)
+        else:
+            raise RuntimeError(f'Playlist entry not understood: {item!r}')
+        return entry
+
+
+    # Returns minute of the day for 'H' or 'H:MM'.  '24' (or '24:00') means
+    # the end of the day.
+    @classmethod
+    def parse_time(cls, s):
+        hours, colon, minutes = s.strip().partition(':')
+        hour = int(hours)
+        minute = int(minutes) if colon else 0
+        if colon and len(minutes) != 2:
+            raise ValueError(s)
+        if not 0 <= hour <= 24 or not 0 <= minute <= 59 or (hour == 24 and minute != 0):
+            raise ValueError(s)
+        return hour * 60 + minute
+
+
+    # Returns a list of the days, as numbers (Monday = 0), for 'mon-fri',
+    # 'sat', ['sat', 'sun'], etc.
+    @classmethod
+    def parse_days(cls, days):
+        if isinstance(days, str):
+            days = [days]
+        numbers = []
+        for day in days:
+            first, _, last = day.strip().lower().partition('-')
+            first = DAY_NAMES.index(first[:3])
+            last = DAY_NAMES.index(last[:3]) if last != '' else first
+            numbers.append(first)
+            while first != last:
+                first = (first + 1) % 7
+                numbers.append(first)
+        return sorted(set(numbers))
+
+
+    # Returns a list of (start, end) minutes of the week
+    @classmethod
+    def parse_windows(cls, hours, days):
+        try:
+            start, end = (cls.parse_time(t) for t in hours.split('-'))
+            day_numbers = cls.parse_days(days)
+        except (ValueError, AttributeError, TypeError):
+            raise RuntimeError(f'Playlist hours "{hours}" or days "{days}" not understood')
+        windows = []
+        for day in day_numbers:
+            week_start = day * MINUTES_PER_DAY + start
+            week_end = day * MINUTES_PER_DAY + end
+            if end <= start:
+                # Runs past midnight into the next day
+                week_end += MINUTES_PER_DAY
+            if week_end <= MINUTES_PER_WEEK:
+                windows.append((week_start, week_end))
+            else:
+                # Sunday night into Monday morning
+                windows.append((week_start, MINUTES_PER_WEEK))
+                windows.append((0, week_end - MINUTES_PER_WEEK))
+        return windows
+
+
+    # Splits the week up wherever any entry starts or stops being in effect,
+    # and works out the running order for each stretch
+    def _compile(self):
+        edges = {0, MINUTES_PER_WEEK}
+        for entry in self.entries:
+            for start, end in entry['windows'] or []:
+                edges.update((start, end))
+        edges = sorted(edges)
+        orders = {}
+        for start, end in zip(edges, edges[1:]):
+            active = tuple(i for i, entry in enumerate(self.entries)
+                           if entry['windows'] is None
+                           or any(w_start <= start < w_end for w_start, w_end in entry['windows']))
+            if len(active) == 0:
+                day, minute = divmod(start, MINUTES_PER_DAY)
+                raise RuntimeError('Nothing in the playlist to show on '
+                                   f'{DAY_NAMES[day].title()} at {minute // 60}:{minute % 60:02}')
+            if active not in orders:
+                orders[active] = len(self._orders)
+                self._orders.append(self.spread_out(active, [self.entries[i]['weight'] for i in active]))
+            self._minutes.extend([orders[active]] * (end - start))
+
+
+    # Returns a running order with each item showing up as many times as its
+    # weight, as evenly spaced as possible.  The order repeats, so spacing is
+    # measured around the end and back to the start too.  The heaviest items
+    # go in first, each spread evenly over the places still free, and the
+    # items with a weight of 1 fill in whatever's left, in order.  (So no
+    # item ends up next to itself unless it has more than half the total
+    # weight.)  With all the weights at 1, that's just the items in order.
+    @classmethod
+    def spread_out(cls, items, weights):
+        total = sum(weights)
+        order = [None] * total
+        for i in sorted(range(len(items)), key=lambda i: -weights[i]):
+            free = [n for n in range(total) if order[n] is None]
+            for k in range(weights[i]):
+                order[free[k * len(free) // weights[i]]] = items[i]
+        return order
+
+
+    # Returns the next entry to show, or None when the requested number of
+    # cycles is done.  Call picked() once the entry has been dealt with.
+    def next(self, segments):
+        now = clock.now()
+        stretch = self._minutes[now.weekday() * MINUTES_PER_DAY + now.hour * 60 + now.minute]
+        order = self._orders[stretch]
+        first_choice = None
+        for tries in range(len(order)):
+            if self.cycles_left == 0:
+                return None
+            entry_num = order[self._positions[stretch]]
+            self._positions[stretch] += 1
+            if self._positions[stretch] == len(order):
+                self._positions[stretch] = 0
+                if self.cycles_left is not None:
+                    self.cycles_left -= 1
+            if first_choice is None:
+                first_choice = entry_num
+            if self._is_due(entry_num, segments):
+                return self._entry(entry_num)
+        # Nothing's due, but we have to show something
+        return self._entry(first_choice)
+
+
+    def _entry(self, entry_num):
+        return dict(self.entries[entry_num], number=entry_num)
+
+
+    def _is_due(self, entry_num, segments):
+        entry = self.entries[entry_num]
+        if entry['min_spacing'] > 0:
+            picked_at = self._picked_at.get(entry['key'])
+            if picked_at is not None and clock.monotonic() - picked_at < entry['min_spacing'] * 60:
+                return False
+        # (Only a segment that's been picked before can have nothing new.  One
+        # that's since been taken out of the config has nothing at all.)
+        if entry['only_new'] and self._versions[entry_num] is not None:
+            if entry['key'] not in segments:
+                return False
+            segment = segments[entry['key']]
+            if segment.fetches_data() and segment.data_version == self._versions[entry_num]:
+                return False
+        return True
+
+
+    # Remembers when the entry was picked, and what data its segment (if
+    # there is one) is about to show
+    def picked(self, entry, segment):
+        self._picked_at[entry['key']] = clock.monotonic()
+        if segment is not None:
+            self._versions[entry['number']] = segment.data_version
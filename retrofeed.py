@@ -22,15 +22,23 @@
 # Standard library imports
 import argparse
 import datetime as dt
-import importlib.util
-import os
 import sys
 import textwrap as tw
 import time
 import tomllib
 
 # RetroFeed imports
+import clock
+from alerts import AlertQueue
+from config_watcher import ConfigWatcher
 from display import Display
+from pipeline import Pipeline
+from playlist import Playlist
+from scheduler import RefreshScheduler
+from segment_parent import SegmentParent
+from segment_set import SegmentSet
+from singleflight import SingleFlight
+from snapshots import SnapshotStore
 
 
 
@@ -38,7 +46,10 @@ from display import Display
 VERSION = '1.0.0'
 COPYRIGHT_YEAR = '2023'
 CONFIG_FILENAME = 'config.toml'
+TRANSCRIPT_FILENAME = 'transcript.txt'
 EXPECTED_TABLES = ['display', 'segments', 'playlist']
+# Settings of the main sink that the headless transcript keeps
+HEADLESS_SINK_KEYS = ['width', 'height', 'cps', 'newline_cps', 'force_uppercase']
 
 
 
@@ -69,53 +80,156 @@ def override_timings(config):
     return config
 
 
-def instantiate_segments(config, d):
-    # Segments dictionary holds references to all instantiated objects
-    segments = {}
-    # Keep track of intro strings we show, so we don't show any more than once
-    shown_intros = []
-    # Go through config and initialize all required segments
-    # We don't check to see if they exist, so... fingers crossed!
-    for key in config['segments']:
-        mod_name = config['segments'][key]['module']
-        # Just in case the user put the .py on the end...
-        if mod_name.endswith('.py'):
-            mod_name = mod_name[0:-3]
-        # Import, instantiate, and add to segments dictionary
-        # using the specified key (which will match in playlist)
-        module = importlib.import_module('segments.' + mod_name)
-        segments[key] = module.Segment(d, config['segments'][key])
-        # If we haven't heard it already, give the module
-        # a chance to introduce itself...
-        intro = segments[key].intro
-        if intro is not None:
-            intro = intro.strip()
-            if intro != '' and intro not in shown_intros:
-                d.print(intro)
-                shown_intros.append(intro)
-    return segments
-
-
-def parse_seg_key_and_fmt(seg):
-    seg_key = ''
-    seg_fmt = {}
-    # If the segment is just a plain-old string,
-    # use that as the key and assume no formatting
-    if isinstance(seg, str):
-        seg_key = seg
-    # But if it's a list, use the first element as key
-    # and second element (if any) as format stuff
-    elif isinstance(seg, list):
-        seg_key = seg[0]
-        if len(seg) > 1:
-            seg_fmt = seg[1]
-    return (seg_key, seg_fmt)
-
-
-def show_title(d):
-    os.system('clear')
-    for i in range(24):
+def set_up_headless(config, transcript):
+    # Swap in a simulated clock, so that all the pauses and slow printing
+    # take no real time at all
+    clock.use(clock.VirtualClock())
+    # Send everything to a single transcript file instead of the usual
+    # sink(s), but keep the main sink's width, etc. so the layout matches.
+    # (Only the layout, though.  A screen model would fill the transcript
+    # with cursor-addressing codes, and serial settings mean nothing here.)
+    sinks = config['display'].get('sinks', [{}])
+    main_sink = sinks[0] if len(sinks) > 0 else {}
+    sink = {key:main_sink[key] for key in HEADLESS_SINK_KEYS if key in main_sink}
+    sink['type'] = 'file'
+    sink['path'] = transcript
+    config['display']['sinks'] = [sink]
+    # Start with an empty transcript
+    open(transcript, 'w').close()
+    # Don't mix simulated timestamps in with the real saved data, or the
+    # statistics of a real run
+    config.pop('state', None)
+    config.pop('metrics', None)
+    return config
+
+
+def print_headless_report(timings, total_seconds, real_seconds, args, segments):
+    print(f'Rendered {args.cycles} playlist cycle(s) to {args.transcript}')
+    print()
+    print(f'{"Segment":<20} {"Showings":>8} {"Seconds":>10} {"Average":>10}')
+    for seg_key, (showings, seconds) in timings.items():
+        print(f'{seg_key:<20} {showings:>8} {seconds:>10.1f} {seconds/showings:>10.1f}')
+    print()
+    print(f'Simulated display time:  {dt.timedelta(seconds=round(total_seconds))}')
+    print(f'Actual time taken:       {real_seconds:.2f}s')
+    fetcher = SegmentParent.fetcher
+    http_stats = fetcher.stats() if fetcher is not None else {}
+    if len(http_stats) > 0:
+        print()
+        print(f'{"Host":<30} {"Requests":>8} {"Opened":>8} {"Reused":>8}')
+        for host, counts in http_stats.items():
+            print(f'{host:<30} {counts["requests"]:>8} {counts["connections"]:>8} {counts["reused"]:>8}')
+    if SegmentParent.flights.shared > 0:
+        print(f'Shared page requests:    {SegmentParent.flights.shared}')
+    alerts = SegmentParent.alerts
+    if alerts is not None and alerts.shown + alerts.missed > 0:
         print()
+        print(f'Alerts shown:            {alerts.shown} ({alerts.missed} missed their deadline)')
+        if alerts.shown > 0:
+            average = alerts.total_latency / alerts.shown
+            print(f'Alert latency:           {average:.1f}s average, {alerts.max_latency:.1f}s max')
+    if fetcher is not None and fetcher.cache is not None:
+        print()
+        print(f'{"Page cache":<20} {"Hits":>8} {"304s":>8} {"Misses":>8}')
+        for seg_key, segment in segments.items():
+            counts = segment.cache_counts
+            if sum(counts.values()) > 0:
+                print(f'{seg_key:<20} {counts["hit"]:>8} {counts["revalidated"]:>8} {counts["miss"]:>8}')
+
+
+def show_alerts(d, segments, segment_pause):
+    # Anything urgent gets shown now, before the playlist carries on
+    for segment in segments.values():
+        segment.check_for_alerts()
+    while True:
+        alert = SegmentParent.alerts.next()
+        if alert is None:
+            return
+        d.newline()
+        d.newline()
+        d.print_header(alert['title'], '!')
+        d.newline()
+        for line in alert['lines']:
+            d.print(line)
+        d.newline()
+        d.newline(segment_pause)
+
+
+def load_config(args):
+    with open(args.filename, 'rb') as f:
+        config = tomllib.load(f)
+    check_config_tables(config)
+    # If user ran with the -f flag, use faster display timings, which is
+    # useful for quickly checking segment order/format changes, etc.
+    if args.fast_mode:
+        config = override_timings(config)
+    if args.headless:
+        config = set_up_headless(config, args.transcript)
+    return config
+
+
+def start_playlist(playlist_settings, playlist, segments):
+    # Segments can break in between other segments with urgent news
+    if not playlist_settings.get('alerts', True):
+        SegmentParent.alerts = None
+    elif SegmentParent.alerts is None:
+        SegmentParent.alerts = AlertQueue()
+    # Upcoming segments get their data refreshed in the background while
+    # the current one is being shown
+    return Pipeline(segments, playlist, playlist_settings.get('prefetch', 1))
+
+
+def apply_config_changes(config, new_config, d, segments, snapshots, scheduler, pipeline, cycles):
+    # Switch over to a changed config file's segments, display settings, and
+    # playlist.  Segments whose settings are the same keep going, data and
+    # all, and a new playlist starts over from the top.  Returns the Pipeline
+    # to carry on with, or None if the new config can't be used, in which
+    # case nothing is changed.  (The [network] and [state] sections, and the
+    # background refresh settings, only take effect on a restart.)
+    playlist = None
+    if new_config['playlist'] != config['playlist']:
+        try:
+            playlist = Playlist(new_config['playlist'], cycles)
+        except RuntimeError:
+            return None
+    if new_config['segments'] != config['segments']:
+        dropped = segments.update(new_config['segments'])
+        if dropped is None:
+            return None
+        if scheduler is not None:
+            for key in dropped:
+                scheduler.remove(key)
+        if snapshots is not None:
+            snapshots.update(new_config['segments'])
+    if new_config['display'] != config['display']:
+        try:
+            d.reconfigure(new_config['display'])
+        except (RuntimeError, OSError):
+            # Keep the old display, but go ahead with everything else
+            new_config['display'] = config['display']
+    if playlist is not None:
+        pipeline.stop()
+        pipeline = start_playlist(new_config['playlist'], playlist, segments)
+    return pipeline
+
+
+# For the metrics gauge:  seconds since each segment's data was refreshed
+def data_ages(segments):
+    ages = {}
+    now = clock.now()
+    for key, segment in segments.items():
+        data = segment.data
+        if isinstance(data, dict) and 'fetched_on' in data:
+            ages[(key,)] = (now - data['fetched_on']).total_seconds()
+    return ages
+
+
+def show_title(d, clear_screen=True):
+    if clear_screen:
+        # ANSI "clear screen" and "cursor home"
+        print('\033[2J\033[H', end='')
+        for i in range(24):
+            print()
     d.print(f'RETROFEED - VERSION {VERSION}')
     d.print(f'Copyright (c) {COPYRIGHT_YEAR} Jeff Jetton')
     d.print('MIT License')
@@ -126,6 +240,20 @@ def get_args():
     parser = argparse.ArgumentParser(description='Send a retro-style newsfeed to stdout.')
     parser.add_argument('-f', '--fast', action='store_true', dest='fast_mode',
                         help='Use fast display speed, overriding config file settings')
+    parser.add_argument('--headless', action='store_true', dest='headless',
+                        help='Render the playlist to a transcript file using a simulated clock, '
+                             'then report how long each segment would take on a real display')
+    parser.add_argument('--cycles', type=int, default=1,
+                        help='Number of playlist cycles to render in headless mode (default 1)')
+    parser.add_argument('--transcript', default=TRANSCRIPT_FILENAME,
+                        help=f'Transcript file for headless mode (default {TRANSCRIPT_FILENAME})')
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', metavar='DIR',
+                          help='Save every web response to a cassette directory, for --replay later')
+    cassette.add_argument('--replay', metavar='DIR',
+                          help='Play back web responses from a cassette directory instead of using the network')
+    parser.add_argument('--replay-latency', type=float, default=0, metavar='SECONDS',
+                        help='Simulated network delay for each response played back with --replay')
     parser.add_argument('-v', '--version', action='version', version='RetroFeed ' + VERSION)
     parser.add_argument('filename', nargs='?', default=CONFIG_FILENAME,
                         help='Specify TOML configuration file. If omitted, defaults to config.toml')
@@ -142,51 +270,154 @@ def main():
     
     # Get config info from the TOML file
     try:
-        with open(args.filename, 'rb') as f:
-            config = tomllib.load(f)
-        check_config_tables(config)
-        # If user ran with the -f flag, use faster display timings, which is
-        # useful for quickly checking segment order/format changes, etc.
-        if args.fast_mode:
-            config = override_timings(config)
+        config = load_config(args)
     except FileNotFoundError:
         print(f'\n*** Missing configuration file "{CONFIG_FILENAME}"\n')
         return
 
+    # In headless mode, we only go through the playlist a set number of
+    # times, keeping track of how long each segment would take to show
+    cycles = args.cycles if args.headless else None
+    playlist = Playlist(config['playlist'], cycles)
+
+    # All segments share one pooled HTTP session
+    network_settings = config.get('network', {})
+    if args.record is not None or args.replay is not None:
+        # Every request needs to reach the cassette, not the page cache
+        network_settings = {k:v for k, v in network_settings.items() if k != 'cache_dir'}
+    # (It's only set up once a segment needs it, so nothing to do with the
+    # web gets imported until then.)
+    SegmentParent.network_settings = network_settings
+    SegmentParent.flights = SingleFlight(network_settings.get('coalesce_seconds', 1))
+    if args.record is not None:
+        from cassette import Cassette
+        SegmentParent.cassette = Cassette(args.record, 'record')
+    elif args.replay is not None:
+        from cassette import Cassette
+        SegmentParent.cassette = Cassette(args.replay, 'replay', args.replay_latency)
+
     # Create Display object from config settings
     # This will be used by all segments
     d = Display(config['display'])
 
-    show_title(d)
-    segments = instantiate_segments(config, d)
+    show_title(d, clear_screen=not args.headless)
+
+    # Each segment is imported and created the first time the playlist gets
+    # to it (see segment_set.py)
+    segments = SegmentSet(config['segments'], d)
+
+    # Optionally keep statistics on everything, and serve them up over HTTP
+    if 'metrics' in config:
+        from metrics import Metrics
+        metrics = Metrics()
+        metrics.set_gauge('retrofeed_data_age_seconds', lambda: data_ages(segments))
+        metrics.serve(config['metrics'])
+        SegmentParent.metrics = metrics
+        d.metrics = metrics
 
-    # Unpack the playlist
-    segment_pause = config['playlist']['segment_pause']
-    order = config['playlist']['order']
+    # Pick up where we left off, if we saved the segments' data last time
+    snapshots = None
+    if 'state' in config:
+        snapshots = SnapshotStore(config['state'], config['segments'])
+        snapshots.load()
+        segments.on_load(snapshots.restore)
 
     d.newline()
     d.newline()
 
+    timings = {}
+    real_start = time.monotonic()
+    clock_start = clock.monotonic()
+
+    # Keep all segments' data fresh in the background, on their own timers
+    scheduler = None
+    if config['playlist'].get('background_refresh', True):
+        scheduler = RefreshScheduler(segments, config['playlist'].get('refresh_workers', 4))
+        segments.on_load(scheduler.add)
+
+    pipeline = start_playlist(config['playlist'], playlist, segments)
+
+    # Changes to the config file are picked up as we go (except when
+    # headless, where the run should go exactly as configured)
+    watcher = None
+    if config['playlist'].get('watch_config', True) and not args.headless:
+        watcher = ConfigWatcher(args.filename, lambda: load_config(args))
+
     # Main loop
     while True:
-        
-        for seg in order:
+
+        # Between segments is when any config changes take effect
+        new_config = watcher.check() if watcher is not None else None
+        if new_config is not None:
+            new_pipeline = apply_config_changes(config, new_config, d, segments, snapshots,
+                                                scheduler, pipeline, cycles)
+            if new_pipeline is not None:
+                pipeline = new_pipeline
+                config = new_config
+        segment_pause = pipeline.playlist.segment_pause
+
+        # Alerts go ahead of everything else, so they're never held up by
+        # more than the segment that was showing when they came in
+        if SegmentParent.alerts is not None:
+            show_alerts(d, segments, segment_pause)
+
+        try:
+            entry = pipeline.next()
+        except Exception as e:
+            d.newline()
+            d.print_header('Playlist Problem', '*')
+            d.print(str(e))
+            d.newline(segment_pause)
+            continue
+        if entry is None:
+            break
+        (seg_key, seg_fmt) = entry
+
+        d.newline()
+        d.newline()
+
+        if seg_key not in segments:
+            d.newline()
+            d.print_header(f'Missing Segment "{seg_key}"', '*')
+            d.newline(segment_pause)
+            continue
+
+        # Segments are only created when they first come up, so a problem
+        # with one's settings turns up here, rather than at startup.  Just
+        # skip it (for now) and keep the rest of the feed going.
+        try:
+            segment = segments[seg_key]
+        except Exception as e:
             d.newline()
+            d.print_header(f'Broken Segment "{seg_key}"', '*')
+            d.print(str(e))
+            d.newline(segment_pause)
+            continue
+
+        # The first time a segment comes up, give the module a chance to
+        # introduce itself (if we haven't heard it already)
+        intro = segments.take_intro(seg_key)
+        if intro is not None:
+            d.print(intro)
             d.newline()
 
-            (seg_key, seg_fmt) = parse_seg_key_and_fmt(seg)
+        # Show the segment, with any special formating
+        seg_start = clock.monotonic()
+        segment.present(seg_fmt)
+        showings, seconds = timings.get(seg_key, (0, 0))
+        timings[seg_key] = (showings + 1, seconds + clock.monotonic() - seg_start)
 
-            if seg_key not in segments:
-                d.newline()
-                d.print_header(f'Missing Segment "{seg_key}"', '*')
-                d.newline(segment_pause)
-                continue
+        # Good time to save everyone's data, while we're between segments
+        if snapshots is not None:
+            snapshots.save(segments)
 
-            # Show the segment, with any special formating
-            segments[seg_key].show(seg_fmt)
+        d.newline()
+        d.newline(segment_pause)
 
-            d.newline()
-            d.newline(segment_pause)
+    if snapshots is not None:
+        snapshots.save(segments, force=True)
+    print_headless_report(timings, clock.monotonic() - clock_start,
+                          time.monotonic() - real_start, args, segments)
 
 
 
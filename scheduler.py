@@ -0,0 +1,89 @@
+################################################################################
+#
+#   RefreshScheduler Class
+#
+#   - Keeps every data-fetching segment's data fresh in the background, so
+#     show() can just use whatever the newest data is and get on with it
+#   - A timer thread checks each segment every few seconds.  Any segment whose
+#     data has gone stale (according to its own refresh interval, or any
+#     other rules it has in data_is_stale()) gets its refresh_data() run on a
+#     small pool of worker threads.
+#   - Segments that appear rarely in the playlist are kept up to date too,
+#     rather than always being stale when their turn finally comes
+#   - A segment whose refreshes are failing is left alone until its backoff
+#     time is up (see refresh_if_stale() in segment_parent.py)
+#   - Segments created later on (as the playlist gets to them) are taken on
+#     with add()
+#
+################################################################################
+
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+
+# How often (in real seconds) to check for stale segments
+CHECK_SECONDS = 5
+
+
+class RefreshScheduler:
+
+    def __init__(self, segments, workers=4):
+        self._pool = ThreadPoolExecutor(max_workers=max(workers, 1),
+                                        thread_name_prefix='refresh')
+        # Keys of segments with a refresh underway
+        self._running = set()
+        self._lock = threading.Lock()
+        self.segments = {}
+        for key, segment in segments.items():
+            self.add(key, segment)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+
+    def add(self, key, segment):
+        # Only bother with segments that actually fetch data
+        if segment.fetches_data():
+            segment.refreshed_in_background = True
+            with self._lock:
+                self.segments[key] = segment
+
+
+    def remove(self, key):
+        with self._lock:
+            self.segments.pop(key, None)
+
+
+    def stop(self):
+        self._stop.set()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+    # Timer thread:  Look for stale segments and hand them off to the pool
+    def _run(self):
+        while not self._stop.is_set():
+            with self._lock:
+                segments = list(self.segments.items())
+            for key, segment in segments:
+                if self._is_due(key, segment):
+                    with self._lock:
+                        self._running.add(key)
+                    self._pool.submit(self._refresh, key, segment)
+            self._stop.wait(CHECK_SECONDS)
+
+
+    def _is_due(self, key, segment):
+        with self._lock:
+            if key in self._running:
+                return False
+        return segment.refresh_is_due()
+
+
+    # Worker thread:  Refresh one segment.  (Failures are dealt with by the
+    # segment itself, which keeps its old data and backs off.)
+    def _refresh(self, key, segment):
+        try:
+            segment.refresh_if_stale()
+        finally:
+            with self._lock:
+                self._running.discard(key)
@@ -0,0 +1,145 @@
+################################################################################
+#
+#   Screen Class
+#
+#   - Optional model of what's currently on a sink's screen:  a grid of
+#     height x width characters, plus where the terminal's cursor really is
+#   - Text headed to the sink is run through encode(), which turns it into
+#     the bytes that actually need to be sent.  Characters that are already
+#     on the screen in the right spot (like all the spaces of a "slow"
+#     newline, or the padding in a header) aren't sent at all.  The cursor
+#     is just moved past them, using whichever is shortest:  a relative
+#     move, an absolute cursor address, or simply re-sending the characters.
+#   - In "ansi" mode, runs of the same character that go out together can
+#     optionally be sent with the REP control sequence (not all terminals
+#     support it, so it's off by default)
+#   - Supports ANSI (VT100 and later) and VT52 cursor control
+#
+#   This mostly matters for slow serial lines, where every byte costs time.
+#   Turn it on for a sink with screen_model = 'ansi' or 'vt52' in the config.
+#
+################################################################################
+
+
+SCREEN_MODELS = ['ansi', 'vt52']
+
+
+class Screen:
+
+    def __init__(self, height, width, model='ansi', use_rep=False):
+        if model not in SCREEN_MODELS:
+            raise RuntimeError(f'Unknown screen model "{model}"')
+        self.height = height
+        self.width = width
+        self.model = model
+        self.use_rep = use_rep and model == 'ansi'
+        # What's on the screen, one list of characters per row
+        self.grid = [[' '] * width for i in range(height)]
+        # Where the next character goes (row, col)...
+        self.row = height - 1
+        self.col = 0
+        # ...and where the terminal's cursor actually is right now
+        self.term_row = self.row
+        self.term_col = 0
+        # We don't know what's on the real screen until we've cleared it
+        self.cleared = False
+        # Running totals, to see how much we're saving
+        self.chars_in = 0
+        self.bytes_out = 0
+
+
+    # Control sequences for the current model
+    def clear_code(self):
+        if self.model == 'vt52':
+            return '\x1bH\x1bJ'
+        return '\x1b[H\x1b[2J'
+
+    def goto_code(self, row, col):
+        if self.model == 'vt52':
+            return '\x1bY' + chr(32 + row) + chr(32 + col)
+        return f'\x1b[{row + 1};{col + 1}H'
+
+    def right_code(self, n):
+        if self.model == 'vt52':
+            return '\x1bC' * n
+        return '\x1b[C' if n == 1 else f'\x1b[{n}C'
+
+
+    # Returns the shortest way to get the terminal's cursor to (row, col)
+    def move_code(self, row, col):
+        options = [self.goto_code(row, col)]
+        if row == self.term_row and col > self.term_col:
+            options.append(self.right_code(col - self.term_col))
+            options.append(''.join(self.grid[row][self.term_col:col]))
+        return min(options, key=len)
+
+
+    # Scroll everything up one line, leaving a blank line at the bottom
+    def scroll(self):
+        self.grid.pop(0)
+        self.grid.append([' '] * self.width)
+
+
+    # Move down to the start of the next line, scrolling if at the bottom.
+    # Always sent, since the terminal needs to scroll too.
+    # (Output processing on the tty turns the newline into CR+LF.)
+    def newline(self, out):
+        out.append('\n')
+        if self.row == self.height - 1:
+            self.scroll()
+        else:
+            self.row += 1
+        self.col = 0
+        self.term_row = self.row
+        self.term_col = 0
+
+
+    # Returns bytes to send to the terminal so that it winds up showing text
+    def encode(self, text):
+        out = []
+        if not self.cleared:
+            out.append(self.clear_code())
+            out.append(self.goto_code(self.row, 0))
+            self.cleared = True
+        for c in text:
+            if c == '\n':
+                self.newline(out)
+                continue
+            # Past the right edge?  Wrap to the next line, same as the
+            # terminal would.
+            if self.col >= self.width:
+                self.newline(out)
+            if self.grid[self.row][self.col] != c:
+                if (self.term_row, self.term_col) != (self.row, self.col):
+                    out.append(self.move_code(self.row, self.col))
+                out.append(c)
+                self.grid[self.row][self.col] = c
+                self.term_row = self.row
+                self.term_col = self.col + 1
+            self.col += 1
+        if self.use_rep:
+            out = self.compress_runs(out)
+        b = ''.join(out).encode()
+        self.chars_in += len(text)
+        self.bytes_out += len(b)
+        return b
+
+
+    # Swaps runs of the same printable character for the character followed
+    # by a REP sequence, wherever that's shorter
+    def compress_runs(self, out):
+        compressed = []
+        i = 0
+        while i < len(out):
+            piece = out[i]
+            run = 1
+            if len(piece) == 1 and piece != '\n':
+                while i + run < len(out) and out[i + run] == piece:
+                    run += 1
+            rep = f'\x1b[{run - 1}b'
+            if run > 1 and len(rep) < run - 1:
+                compressed.append(piece + rep)
+            else:
+                compressed.extend(out[i:i + run])
+            i += run
+        return compressed
@@ -9,9 +9,105 @@
 #     __init__():     Takes care of most standard instantiation tasks
 #                     Call as super().__init__(display, init)
 #
-#     data_is_stale:  Returns boolean indicating whether you need a refresh
+#     data_is_stale:  Returns boolean indicating whether the data is due to
+#                     be refreshed
 #
-#     get_soup:       Returns a BeautifulSoup object from a url
+#     needs_refresh:  Returns boolean indicating whether show() needs to do a
+#                     refresh itself before showing anything.  When the data
+#                     is being refreshed in the background, that's only true
+#                     when there isn't any data at all yet.
+#
+#     refresh_if_stale:
+#                     Calls refresh_data() if the data is stale, making sure
+#                     only one refresh of a segment happens at a time
+#
+#   When a site is down (or sends back something unusable), refresh_data()
+#   should raise RefreshFailed rather than replace good data with nothing.
+#   The last good data is then kept and shown, while retries happen less and
+#   less often (backing off exponentially) until the site comes back.  Any
+#   other exception in refresh_data() is treated the same way.  If there's no
+#   data at all yet, self.data stays None, so show() needs to handle that.
+#
+#   Time limits (in seconds) can be set for each segment in its [segments]
+#   entry in the config file, or left at the defaults below:
+#
+#     connect_timeout Waiting to connect to a site (default 5)
+#     read_timeout    Waiting for a site to send anything (default 15)
+#     refresh_timeout Total time for refresh_data(), including all fetching
+#                     and parsing (default 60)
+#     show_timeout    Total time for showing the segment (default 600).  Keep
+#                     in mind that slow printing takes time too!
+#
+#   A refresh that runs over is abandoned and counted as a failure, so the
+#   last good data gets shown instead.  A showing that runs over is cut off,
+#   and the feed moves on to the next segment.
+#
+#     stale_note:     Returns a note like "(Last updated 3 hours ago)" when
+#                     showing data that's overdue for a refresh, else None
+#
+#     prepare:        Refreshes the data ahead of time, if it's stale.  Called
+#                     from a background thread shortly before the segment is
+#                     due to be shown.
+#
+#   Because refreshes can happen in a background thread, refresh_data() should
+#   build up its data separately and then assign it to self.data in one go at
+#   the end, rather than assigning self.data first and then filling it in.
+#   A new self.data assigned while the segment is being shown is held back
+#   until the showing is over.
+#
+#     output_is_reusable:
+#                     Override to return True if, for the passed format, show()
+#                     always prints exactly the same thing until the data is
+#                     next refreshed.  present() can then just replay the
+#                     output from last time, rather than calling show() again.
+#
+#     get_snapshot:   Returns what should be saved for a warm restart
+#     restore_snapshot:
+#                     Puts back what get_snapshot() returned.  By default,
+#                     that's just self.data, so override these if a segment
+#                     keeps anything else worth saving.  Data should be plain
+#                     stuff (dicts, lists, strings, datetimes) that can be
+#                     pickled.
+#
+#     check_alerts:   Override to post urgent news with post_alert(), based
+#                     on the passed data (the newest there is, which might
+#                     not be self.data yet).  Called after every successful
+#                     refresh, and between segments, so it's good for things
+#                     that only become urgent as time goes by, too.  Keep it
+#                     quick, and don't print anything.
+#
+#     post_alert:     Queues up an alert to be shown between segments, ahead
+#                     of the rest of the playlist (see alerts.py).  Posting
+#                     the same key again is ignored, so it's fine to keep
+#                     posting whatever's urgent every time.
+#
+#     fetch:          Returns the raw HTTP response for a url
+#
+#     get_soup:       Returns a BeautifulSoup object from a url.  Pass a
+#                     SoupStrainer as "only" to build the tree out of just
+#                     the elements you're after (and whatever's inside them),
+#                     which is a lot quicker than parsing the whole page.
+#                     Make the strainer once, at the module level.
+#
+#     parse_html:     Same as get_soup(), for text you've already got
+#
+#     fetch_stream:   Returns an HTTP response whose body hasn't been
+#                     downloaded yet, to read bit by bit with iter_content()
+#                     and stop once you've got what you need.  (These don't
+#                     go through the page cache or get shared between
+#                     segments.)  Use it in a "with" statement, so it's closed
+#                     when you're done.
+#
+#   All web requests should go through fetch() or get_soup(), which share a
+#   pooled, keep-alive HTTP session (see fetcher.py) and the optional on-disk
+#   page cache.  Each segment keeps count of how its requests went with the
+#   cache, in cache_counts.  When a page hasn't changed since get_soup() last
+#   parsed it, the same soup is handed back again, so don't modify it.
+#   Segments asking for the same page at the same time (or within a second or
+#   so of each other) share a single download and parse, too.
+#   If statistics are turned on (see metrics.py), the time taken, status,
+#   and size of each request are recorded under the segment's key, along with
+#   parsing, refresh, and showing times.
 #
 #
 #   Jeff Jetton, April 2023
@@ -20,42 +116,363 @@
 
 
 from abc import ABC, abstractmethod
-from bs4 import BeautifulSoup
+import clock
 import datetime as dt
-import requests
+import importlib.util
+from singleflight import SingleFlight
+import threading
+import time
+from watchdog import Overrun, run_with_deadline
+
+# Use the faster lxml parser if it's installed.  (Just checking that it's
+# there, without importing it.  BeautifulSoup, requests, and the rest of the
+# web stuff only get imported once some segment actually fetches something,
+# which keeps start-up quick.)
+if importlib.util.find_spec('lxml') is not None:
+    HTML_PARSER = 'lxml'
+else:
+    HTML_PARSER = 'html.parser'
+
+
+# Raised by refresh_data() when it can't get good data
+class RefreshFailed(Exception):
+    pass
 
 
 class SegmentParent(ABC):
+
+    # Shared by all segments.  Created the first time it's needed, from the
+    # [network] section of the config (passed along by retrofeed.py), along
+    # with any cassette to record to or play back from.
+    fetcher = None
+    network_settings = {}
+    cassette = None
+    _fetcher_lock = threading.Lock()
+    # Requests for the same page that overlap are only done once
+    flights = SingleFlight()
+    # Where alerts get posted (an AlertQueue, set up by retrofeed.py).
+    # Without one, post_alert() doesn't do anything.
+    alerts = None
+    # Running statistics (see metrics.py), if they're turned on
+    metrics = None
+
+    # Number of parsed pages each segment holds onto, for get_soup() to
+    # hand back if they haven't changed.  A segment that fetches more pages
+    # than this each refresh should raise self.keep_soups to match, or its
+    # pages will all be pushed out before they come round again.
+    KEEP_SOUPS = 8
+
+    # Wait between retries of a failing refresh, doubling after each failure
+    RETRY_MIN_SECONDS = 30
+    RETRY_MAX_SECONDS = 30 * 60
+
+    # Default time limits, in seconds
+    CONNECT_TIMEOUT = 5
+    READ_TIMEOUT = 15
+    REFRESH_TIMEOUT = 60
+    SHOW_TIMEOUT = 600
     
     def __init__(self, display, init, default_refresh=60, default_intro=None):
         # Remember reference to main Display object, using "d" for brevity
         self.d = display
+        # Key the segment was declared under in the config (set by retrofeed.py)
+        self.key = None
         # Assign refresh time and intro (or use default if not found in init)
         ref = init.get('refresh', default_refresh)
         ref = 1 if ref < 1 else ref
         self.refresh = dt.timedelta(minutes=ref)
         self.intro = init.get('intro', default_intro)
+        # Time limits
+        self.connect_timeout = init.get('connect_timeout', self.CONNECT_TIMEOUT)
+        self.read_timeout = init.get('read_timeout', self.READ_TIMEOUT)
+        self.refresh_timeout = init.get('refresh_timeout', self.REFRESH_TIMEOUT)
+        self.show_timeout = init.get('show_timeout', self.SHOW_TIMEOUT)
         # Any fetched data will eventually be encapsulated into the 'data'
         # instance variable.  But for now, we'll set it to None to indicate
         # that we haven't done any fetching yet. 
+        self._data_version = 0
+        self._data_lock = threading.Lock()
+        self._presenting_thread = None
+        self._incoming_data = None
         self.data = None
+        # Recorded output of earlier showings, by format, for present()
+        self._frames = {}
+        # Only one refresh at a time (background or not) for any one segment
+        self._refresh_lock = threading.Lock()
+        # Set by the RefreshScheduler when it's keeping our data fresh
+        self.refreshed_in_background = False
+        # Failed refreshes in a row, the last thing that went wrong, and
+        # when (on clock.monotonic()) it's OK to try again
+        self.refresh_failures = 0
+        self.last_refresh_error = None
+        self._retry_at = None
+        # When (on clock.monotonic()) the last successful refresh finished
+        self._refreshed_at = None
+        # A refresh that ran over its time limit and might still be going
+        self._overrun_refresh = None
+        # How our web requests went with the page cache, and recently parsed
+        # pages by url:  {url: (cache_version, strainer, soup)}
+        self.cache_counts = {'hit':0, 'revalidated':0, 'miss':0}
+        self._soups = {}
+        self.keep_soups = self.KEEP_SOUPS
+        self._fetch_lock = threading.Lock()
+
+
+    # Every time 'data' gets assigned, we bump up its version number, so we
+    # can tell whether any recorded output is still current
+    @property
+    def data(self):
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        with self._data_lock:
+            # Don't switch data out from under a showing that's in progress
+            # in some other thread.  Hold onto it until that's done.
+            presenter = self._presenting_thread
+            if presenter is not None and presenter != threading.get_ident():
+                self._incoming_data = [value]
+                return
+            self._data = value
+            self._data_version += 1
+
+    # Switch to any data that was held back during a showing
+    def _take_incoming_data(self):
+        with self._data_lock:
+            if self._incoming_data is not None:
+                self._data = self._incoming_data[0]
+                self._data_version += 1
+                self._incoming_data = None
+
+    @property
+    def data_version(self):
+        return self._data_version
 
 
     def data_is_stale(self):
         # Returns whether or not we need to refresh the data.
         # Depends on 'data', if it is not None, having a 'fetched_on' value
         # representing the datetime of most-recent refresh.
-        return self.data is None or dt.datetime.now() - self.data['fetched_on'] >= self.refresh
+        return self.data is None or clock.now() - self.data['fetched_on'] >= self.refresh
+
+
+    def refresh_data(self):
+        # Segments that fetch data override this to (re)assign self.data.
+        # Segments that don't (like date_time) can just ignore it.
+        pass
+
+
+    def fetches_data(self):
+        # True if this segment has a refresh_data() of its own
+        return type(self).refresh_data is not SegmentParent.refresh_data
+
+
+    def refresh_is_due(self):
+        # Stale, and not waiting to retry after a failure (or on a refresh
+        # that ran over its time limit and still hasn't given up).  Some
+        # segments can have data that's still stale right after a refresh
+        # (like us_weather, when weather.gov's latest observation is late),
+        # so never refresh again sooner than the usual refresh time after a
+        # successful one.
+        now = clock.monotonic()
+        if self._retry_at is not None and now < self._retry_at:
+            return False
+        if self._refreshed_at is not None and now - self._refreshed_at < self.refresh.total_seconds():
+            return False
+        if self._overrun_refresh is not None and self._overrun_refresh.is_alive():
+            return False
+        return self.data_is_stale()
+
+
+    def needs_refresh(self):
+        # Called by show() to decide whether to refresh before showing.
+        # If the scheduler is keeping us up to date in the background, stale
+        # data is fine to show for now.  We only need to wait if we have
+        # nothing at all.
+        if self.refreshed_in_background and self.data is not None:
+            return False
+        return self.refresh_is_due()
+
+
+    def refresh_if_stale(self):
+        # If another thread is already refreshing, this waits for it to
+        # finish, after which the data probably won't be stale anymore
+        with self._refresh_lock:
+            if self._presenting_thread == threading.get_ident():
+                self._take_incoming_data()
+            if not self.refresh_is_due():
+                return
+            start = time.monotonic()
+            try:
+                run_with_deadline(self.refresh_data, self.refresh_timeout,
+                                  f'Refresh of "{self.key}"', self._refresh_overran)
+            except Exception as e:
+                if SegmentParent.metrics is not None:
+                    SegmentParent.metrics.count('retrofeed_refresh_failures_total', (self.key,))
+                # Keep whatever data we've got, and try again later
+                self.refresh_failures += 1
+                self.last_refresh_error = e
+                wait = self.RETRY_MIN_SECONDS * 2 ** min(self.refresh_failures - 1, 16)
+                self._retry_at = clock.monotonic() + min(wait, self.RETRY_MAX_SECONDS)
+                return
+            if SegmentParent.metrics is not None:
+                SegmentParent.metrics.observe('retrofeed_refresh_seconds', (self.key,), time.monotonic() - start)
+            self.refresh_failures = 0
+            self.last_refresh_error = None
+            self._retry_at = None
+            self._refreshed_at = clock.monotonic()
+            # The refresh ran in a thread of its own, so if we're in the
+            # middle of showing, its new data got held back.  We want it now.
+            if self._presenting_thread == threading.get_ident():
+                self._take_incoming_data()
+        self.check_for_alerts()
+
+
+    def _refresh_overran(self, thread):
+        self._overrun_refresh = thread
+
+
+    def stale_note(self):
+        if self.data is None or clock.now() - self.data['fetched_on'] < self.refresh:
+            return None
+        minutes = int((clock.now() - self.data['fetched_on']).total_seconds() / 60)
+        if minutes < 120:
+            age = f'{minutes} minutes'
+        elif minutes < 48 * 60:
+            age = f'{minutes // 60} hours'
+        else:
+            age = f'{minutes // (24 * 60)} days'
+        return f'(Last updated {age} ago)'
+
+
+    def check_alerts(self, data):
+        # Segments with anything urgent to say override this
+        pass
+
+
+    def check_for_alerts(self):
+        # Calls check_alerts() with the newest data, including any that's
+        # being held back until a showing is over
+        with self._data_lock:
+            data = self._incoming_data[0] if self._incoming_data is not None else self._data
+        if data is None:
+            return
+        try:
+            self.check_alerts(data)
+        except Exception:
+            # Not worth taking the feed down over
+            pass
+
+
+    def post_alert(self, key, title, lines, deadline, priority=0):
+        # The key only has to be unique within this segment
+        if SegmentParent.alerts is not None:
+            SegmentParent.alerts.post((self.key, key), title, lines, deadline, priority)
+
+
+    def get_snapshot(self):
+        return self.data
+
+
+    def restore_snapshot(self, data):
+        self.data = data
+
+
+    def prepare(self):
+        # Get fresh data now, if it's needed, so that show() won't have to
+        if self.fetches_data():
+            self.refresh_if_stale()
+
+
+    def fetch(self, url):
+        # Returns the requests Response object for the passed url
+        return SegmentParent.flights.do(('fetch', url), lambda: self._fetch(url))
 
 
     @classmethod
-    def get_soup(cls, url):
+    def get_fetcher(cls):
+        with SegmentParent._fetcher_lock:
+            if SegmentParent.fetcher is None:
+                from fetcher import Fetcher
+                fetcher = Fetcher(SegmentParent.network_settings)
+                fetcher.cassette = SegmentParent.cassette
+                SegmentParent.fetcher = fetcher
+        return SegmentParent.fetcher
+
+
+    def _fetch(self, url):
+        timeout = (self.connect_timeout, self.read_timeout)
+        response = self._record_fetch(lambda: self.get_fetcher().get(url, timeout=timeout))
+        if response.cache_status is not None:
+            with self._fetch_lock:
+                self.cache_counts[response.cache_status] += 1
+        metrics = SegmentParent.metrics
+        if metrics is not None:
+            if response.cache_status in (None, 'miss'):
+                metrics.count('retrofeed_downloaded_bytes_total', (self.key,), len(response.content))
+            if response.cache_status is not None:
+                metrics.count('retrofeed_cache_requests_total', (self.key, response.cache_status))
+        return response
+
+
+    def fetch_stream(self, url):
+        # (The time recorded is just until the response starts coming in)
+        timeout = (self.connect_timeout, self.read_timeout)
+        return self._record_fetch(lambda: self.get_fetcher().get_stream(url, timeout=timeout))
+
+
+    # Returns get()'s response, keeping statistics on it
+    def _record_fetch(self, get):
+        metrics = SegmentParent.metrics
+        if metrics is None:
+            return get()
+        start = time.monotonic()
+        try:
+            response = get()
+        except Exception:
+            metrics.count('retrofeed_fetch_errors_total', (self.key,))
+            raise
+        metrics.observe('retrofeed_fetch_seconds', (self.key,), time.monotonic() - start)
+        metrics.count('retrofeed_http_responses_total', (self.key, str(response.status_code)))
+        return response
+
+
+    def get_soup(self, url, only=None):
         # Returns a parsed BeautifulSoup object from passed url, or None
         # if the HTTP request fails
-        response = requests.get(url, headers={'Cache-Control': 'no-cache'})
+        return SegmentParent.flights.do(('soup', url, only), lambda: self._get_soup(url, only))
+
+
+    def _get_soup(self, url, only):
+        response = self.fetch(url)
         if response.status_code != 200:
             return None
-        return BeautifulSoup(response.text, 'html.parser')
+        version = response.cache_version
+        if version is not None:
+            with self._fetch_lock:
+                kept_version, kept_only, soup = self._soups.get(url, (None, None, None))
+                if kept_version == version and kept_only is only:
+                    # Move it to the back of the line, as the most recently used
+                    self._soups[url] = self._soups.pop(url)
+                    return soup
+        start = time.monotonic()
+        soup = self.parse_html(response.text, only)
+        if SegmentParent.metrics is not None:
+            SegmentParent.metrics.observe('retrofeed_parse_seconds', (self.key,), time.monotonic() - start)
+        if version is not None:
+            with self._fetch_lock:
+                self._soups.pop(url, None)
+                self._soups[url] = (version, only, soup)
+                while len(self._soups) > self.keep_soups:
+                    del self._soups[next(iter(self._soups))]
+        return soup
+
+
+    @classmethod
+    def parse_html(cls, text, only=None):
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(text, HTML_PARSER, parse_only=only)
+
 
     @classmethod
     def clamp(cls, value, min, max):
@@ -67,6 +484,72 @@ class SegmentParent(ABC):
         return value
 
 
+    def output_is_reusable(self, fmt):
+        # By default, assume show() might print something different each time
+        return False
+
+
+    def present(self, fmt):
+        # Called by the main program when it's the segment's turn to display.
+        # Calls show(), unless we've got a recording of what show() printed
+        # last time for this format, and it's still valid, in which case the
+        # Display just plays that back without redoing any of the layout.
+        # The showing happens in a thread of its own, so the watchdog can
+        # give up on it if it runs too long
+        start = clock.monotonic()
+        try:
+            run_with_deadline(lambda: self._present_watched(fmt), self.show_timeout,
+                              f'Showing of "{self.key}"', self.d.abandon)
+        except Overrun:
+            with self._data_lock:
+                self._presenting_thread = None
+            self._take_incoming_data()
+            self.d.newline()
+            self.d.print('*** Segment Timed Out ***')
+        if SegmentParent.metrics is not None:
+            SegmentParent.metrics.observe('retrofeed_show_seconds', (self.key,), clock.monotonic() - start)
+
+
+    def _present_watched(self, fmt):
+        self._take_incoming_data()
+        with self._data_lock:
+            self._presenting_thread = threading.get_ident()
+        self.d.metrics_segment = self.key
+        try:
+            self._present(fmt)
+        finally:
+            self.d.metrics_segment = None
+            with self._data_lock:
+                if self._presenting_thread == threading.get_ident():
+                    self._presenting_thread = None
+            self._take_incoming_data()
+
+
+    def _present(self, fmt):
+        if not self.output_is_reusable(fmt):
+            self.show(fmt)
+            return
+        fmt_key = repr(sorted(fmt.items()))
+        # Stale data gets shown with a note about its age, which changes over
+        # time, so that always needs a fresh showing
+        if not self.needs_refresh() and not self.data_is_stale():
+            version, frame = self._frames.get(fmt_key, (None, None))
+            if version == self.data_version and self.d.replay(frame):
+                return
+        # Only keep the recording if show() didn't need to refresh anything,
+        # so we don't wind up replaying an "updating..." message later
+        version = self.data_version
+        self.d.start_recording()
+        try:
+            self.show(fmt)
+        finally:
+            frame = self.d.stop_recording()
+        if version == self.data_version:
+            # Clear out any recordings for older data while we're at it
+            self._frames = {k:v for k, v in self._frames.items() if v[0] == version}
+            self._frames[fmt_key] = (version, frame)
+
+
     @abstractmethod
     def show(self, fmt):
         # Called by the main program when it's the segment's turn to display
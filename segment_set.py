@@ -0,0 +1,156 @@
+################################################################################
+#
+#   SegmentSet Class
+#
+#   - Holds the segments declared in the [segments] section of the config,
+#     and looks like a dictionary of them, by key
+#   - A segment's module isn't imported, and the segment isn't created, until
+#     the first time it's asked for (usually when the playlist gets to it).
+#     That way RetroFeed can get something on the screen right away, instead
+#     of importing everything (and everything those import) first.
+#   - Modules are only checked to exist up front, so a typo in the config
+#     still gets caught at startup
+#   - items() and values() only cover the segments that have been created so
+#     far.  Use on_load() to hear about each one as it's created.
+#   - update() switches to new settings when the config file changes,
+#     keeping the segments whose settings are the same (data and all).  New
+#     and changed segments are created right then, so bad settings get caught
+#     before anything is switched over, but on_load() callbacks still wait
+#     until each one is first asked for.
+#
+################################################################################
+
+import importlib
+import importlib.util
+import threading
+
+
+class SegmentSet:
+
+    def __init__(self, segment_settings, display):
+        self.d = display
+        # Config for each segment, by key, and the module it comes from
+        self.settings = segment_settings
+        self.modules = self._find_modules(segment_settings)
+        self._segments = {}
+        # Segments created by update(), but not yet asked for
+        self._pending = {}
+        self._callbacks = []
+        self._lock = threading.Lock()
+        # Intro strings shown so far (so none gets shown more than once), and
+        # keys of segments whose intro hasn't been asked for yet
+        self._shown_intros = []
+        self._new_keys = []
+
+
+    @classmethod
+    def _find_modules(cls, segment_settings):
+        modules = {}
+        for key, init in segment_settings.items():
+            mod_name = init['module']
+            # Just in case the user put the .py on the end...
+            if mod_name.endswith('.py'):
+                mod_name = mod_name[0:-3]
+            if importlib.util.find_spec('segments.' + mod_name) is None:
+                raise RuntimeError(f'Segment module "{mod_name}" for "{key}" not found')
+            modules[key] = mod_name
+        return modules
+
+
+    # Switches to new segment settings.  Segments whose settings haven't
+    # changed carry on as they are.  The rest are thrown out, and replaced by
+    # new ones, created from the new settings.  Returns the keys of the ones
+    # thrown out.  If any module can't be found, or any new segment can't be
+    # created, nothing changes, and None is returned.
+    def update(self, segment_settings):
+        try:
+            modules = self._find_modules(segment_settings)
+        except (RuntimeError, KeyError, TypeError, AttributeError):
+            return None
+        changed = [key for key in segment_settings
+                   if segment_settings[key] != self.settings.get(key)]
+        built = {}
+        for key in changed:
+            try:
+                built[key] = self._create(key, modules[key], segment_settings[key])
+            except Exception:
+                return None
+        with self._lock:
+            dropped = [key for key in self._segments
+                       if key in changed or key not in segment_settings]
+            for key in dropped:
+                del self._segments[key]
+                if key in self._new_keys:
+                    self._new_keys.remove(key)
+            self._pending = {key:segment for key, segment in self._pending.items()
+                             if key in segment_settings and key not in changed}
+            self._pending.update(built)
+            self.settings = segment_settings
+            self.modules = modules
+        return dropped
+
+
+    # Calls callback(key, segment) for each segment as it's created
+    def on_load(self, callback):
+        self._callbacks.append(callback)
+
+
+    def __contains__(self, key):
+        return key in self.modules
+
+
+    def __getitem__(self, key):
+        with self._lock:
+            segment = self._segments.get(key)
+            if segment is None:
+                segment = self._load(key)
+        return segment
+
+
+    # Import and instantiate
+    def _create(self, key, mod_name, init):
+        module = importlib.import_module('segments.' + mod_name)
+        segment = module.Segment(self.d, init)
+        segment.key = key
+        return segment
+
+
+    # Create (unless update() already has) and let everyone know.  Called
+    # with the lock held.
+    def _load(self, key):
+        segment = self._pending.pop(key, None)
+        if segment is None:
+            segment = self._create(key, self.modules[key], self.settings[key])
+        for callback in self._callbacks:
+            callback(key, segment)
+        self._segments[key] = segment
+        self._new_keys.append(key)
+        return segment
+
+
+    def items(self):
+        with self._lock:
+            return list(self._segments.items())
+
+
+    def values(self):
+        with self._lock:
+            return list(self._segments.values())
+
+
+    # Returns the intro for a segment that's just been created, the first
+    # time it's asked for, unless another segment already had the same one.
+    # Otherwise None.
+    def take_intro(self, key):
+        with self._lock:
+            if key not in self._new_keys:
+                return None
+            self._new_keys.remove(key)
+            intro = self._segments[key].intro
+        if intro is None:
+            return None
+        intro = intro.strip()
+        if intro == '' or intro in self._shown_intros:
+            return None
+        self._shown_intros.append(intro)
+        return intro
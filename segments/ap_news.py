@@ -15,6 +15,15 @@
 #       max_items   Number of articles to try to pull down with each refresh
 #                   (default=15, min=1, max=30)
 #
+#       fetch_workers   Number of articles to download at the same time
+#                       (default=4, min=1, max=16).  Going above the
+#                       [network] pool_size just opens extra connections
+#                       that don't get kept.
+#
+#       fetch_budget    Seconds a refresh will wait for the articles to come
+#                       in (default=10, min=1).  Any that aren't in yet are
+#                       picked up later, when it's their turn to be shown.
+#
 #
 #   - Format parameters:
 #
@@ -39,12 +48,21 @@
 ################################################################################
 
 
-import datetime as dt
-from segment_parent import SegmentParent
+from bs4 import SoupStrainer
+import clock
+from concurrent.futures import ThreadPoolExecutor, wait
+import re
+from segment_parent import RefreshFailed, SegmentParent
 
 
 INTRO = 'News from apnews.com'
 
+# The only parts of the pages we need
+# (While parsing, a strainer sees the whole class attribute as one string, so
+# a plain class name wouldn't match a div that has other classes too)
+HUB_ONLY = SoupStrainer('div', class_=re.compile(r'(^|\s)PagePromo-content(\s|$)'))
+STORY_ONLY = SoupStrainer('div', class_=re.compile(r'(^|\s)RichTextStoryBody(\s|$)'))
+
 
 class Segment(SegmentParent):
 
@@ -53,10 +71,19 @@ class Segment(SegmentParent):
         super().__init__(display, init, default_refresh=30, default_intro=INTRO)
         max_items = init.get('max_items', 15)
         self.max_items = self.clamp(max_items, 1, 30)
+        self.fetch_workers = self.clamp(init.get('fetch_workers', 4), 1, 16)
+        self.fetch_budget = max(init.get('fetch_budget', 10), 1)
+        # Hang onto the parsed hub page and every story, in case they come
+        # back unchanged next time
+        self.keep_soups = self.max_items + 1
+        self._executor = None
+        # Story downloads that hadn't finished by the end of the last refresh,
+        # by url.  (Kept out of self.data, which should stay plain data.)
+        self._pending = {}
 
 
     def get_story(self, url):
-        soup = self.get_soup(url)
+        soup = self.get_soup(url, only=STORY_ONLY)
         if soup is None:
             return None
         story_div = soup.find('div', 'RichTextStoryBody')
@@ -69,41 +96,86 @@ class Segment(SegmentParent):
         return story
     
     
+    # Downloads the stories for the passed items, several at a time.  Items
+    # whose story is still on its way when the time budget runs out are left
+    # without a 'story' key, for finish_story() to deal with later.
+    def get_stories(self, items):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        futures = {item['url']:self._executor.submit(self.get_story, item['url'])
+                   for item in items}
+        done, not_done = wait(futures.values(), timeout=self.fetch_budget)
+        pending = {}
+        for item in items:
+            future = futures[item['url']]
+            if future in done:
+                item['story'] = self.story_result(future)
+            else:
+                pending[item['url']] = future
+        self._pending = pending
+
+
+    # Returns the story from a finished download, or None if it failed
+    def story_result(self, future):
+        try:
+            return future.result()
+        except Exception:
+            return None
+
+
+    # Gets the story for an item that didn't have one by the end of the
+    # refresh, waiting on its download if it's still going
+    def finish_story(self, item):
+        future = self._pending.pop(item['url'], None)
+        if future is None:
+            # Download from an earlier refresh that's been forgotten about
+            try:
+                return self.get_story(item['url'])
+            except Exception:
+                return None
+        return self.story_result(future)
+
+
     def refresh_data(self):
-        self.data = {'fetched_on':dt.datetime.now(),
-                     'item_index':0,
-                     'items':[],
-                    }
+        data = {'fetched_on':clock.now(),
+                'item_index':0,
+                'items':[],
+               }
         url = 'https://apnews.com/hub/ap-top-news'
-        soup = self.get_soup(url)
+        soup = self.get_soup(url, only=HUB_ONLY)
         if soup is None:
-            return
+            raise RefreshFailed('AP News hub page unavailable')
         # Get divs of interest, up to max_items
         story_divs = soup.find_all('div', 'PagePromo-content', limit=self.max_items)
         # Get the urls and titles/headlines from those divs
         for story in story_divs:
             url_obj = story.find('a', 'Link')
+            if url_obj is None:
+                continue
             url = url_obj.get('href')
             headline = url_obj.get_text()
             if url is not None and headline is not None:
                 headline = self.d.clean_chars(headline)
-                self.data['items'].append({'headline':headline, 'url':url})
+                data['items'].append({'headline':headline, 'url':url})
+        # Don't replace the news we've got with nothing
+        if len(data['items']) == 0:
+            raise RefreshFailed('No AP News items found')
         # Try to get full stories for the linked articles
-        for item in self.data['items']:
-            item['story'] = self.get_story(item['url'])
-        # Add a special "item" if no items were found
-        if len(self.data['items']) == 0:
-            self.data['items'].append({'headline':'*** Newsfeed Unavailable ***', 'story':None, 'url':None})
+        self.get_stories(data['items'])
+        self.data = data
 
 
     def show_stories(self, num_items, item_length):
         self.d.print_header('AP News', '!')
+        self.print_stale_note()
         self.d.newline()
         for i in range(num_items):
             self.d.newline(self.d.beat_delay)
             if item_length > 1 and i > 0:
                 self.d.newline()
             item = self.data['items'][self.data['item_index']]
+            if 'story' not in item:
+                item['story'] = self.finish_story(item)
             if item['story'] is None or len(item['story']) == 0:
                 self.d.print('*** Item Story Unavailable ***')
             else:
@@ -118,6 +190,7 @@ class Segment(SegmentParent):
 
     def show_headlines(self, num_headlines):
         self.d.print_header('AP Top Headlines', '!')
+        self.print_stale_note()
         for i, item in enumerate(self.data['items']):
             if i >= num_headlines:
                 break
@@ -125,14 +198,32 @@ class Segment(SegmentParent):
             self.d.print(item['headline'])
 
 
+    def print_stale_note(self):
+        note = self.stale_note()
+        if note is not None:
+            self.d.print(note)
+
+
+    # Headlines always start from the top, so they only change when the data
+    # does.  Regular stories move along to the next items each time.
+    def output_is_reusable(self, fmt):
+        return fmt.get('headline_mode', False)
+
+
     def show(self, fmt):
 
         headline_mode = fmt.get('headline_mode', False)
         
         # Refresh?
-        if self.data_is_stale():
+        if self.needs_refresh():
             self.d.print_update_msg('Getting Latest News')
-            self.refresh_data()
+            self.refresh_if_stale()
+
+        if self.data is None:
+            self.d.print_header('AP News', '!')
+            self.d.newline()
+            self.d.print('*** Newsfeed Unavailable ***')
+            return
 
         if headline_mode:
             num_items = fmt.get('items', self.max_items)
@@ -10,7 +10,7 @@
 #
 ################################################################################
 
-import datetime as dt
+import clock
 from segment_parent import SegmentParent
 
 
@@ -31,7 +31,7 @@ class Segment(SegmentParent):
         if fmt not in ('long', 'short', 'longdate', 'longtime', 'shortdate', 'shorttime'):
             fmt = 'long'
 
-        now = dt.datetime.now()
+        now = clock.now()
 
         # The Display object comes with some handy date/time formatters
         # By default, fmt_time_text() heeds 12/24hr preference specified
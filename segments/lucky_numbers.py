@@ -16,6 +16,7 @@
 #
 ################################################################################
 
+import clock
 import datetime as dt
 import random
 from segment_parent import SegmentParent
@@ -27,7 +28,7 @@ class Segment(SegmentParent):
 
     def get_lucky_numbers(self):
         # Get the number of days since Jan 1, 1970 (local)
-        days = (dt.datetime.now() - dt.datetime(1970,1,1)).days
+        days = (clock.now() - dt.datetime(1970,1,1)).days
         # Get MAC address
         mac = uuid.getnode()
         # Build today's seed from those two things
@@ -14,6 +14,8 @@
 #       city             City to pass to website (default = Nashville)
 #       location         Optional text to use as displayed location, overriding
 #                        the display of country, region, and city
+#       alert_minutes    Break in with an alert when a sighting is this many
+#                        minutes away or less (default=15, 0 for no alerts)
 #
 #       Visit spotthestation.nasa.gov and select city/town.  Examine resulting
 #       URL to get the necessary country/region/city to use.
@@ -31,13 +33,18 @@
 ################################################################################
 
 
+from bs4 import SoupStrainer
+import clock
 import datetime as dt
-from segment_parent import SegmentParent
+from segment_parent import RefreshFailed, SegmentParent
 
 
 DATE_FORMAT = "{ts '%Y-%m-%d %H:%M:%S'}"
 INTRO = 'ISS Sightings provided by spotthestation.nasa.gov'
 
+# The only part of the page we need
+WIDGET_ONLY = SoupStrainer('div', id='widget_info')
+
 
 class Segment(SegmentParent):
                   
@@ -53,6 +60,7 @@ class Segment(SegmentParent):
             self.region = 'Tennessee'
             self.city = 'Nashville'
         self.location = init.get('location', f'{self.city}, {self.region}, {self.country}'.replace('_', ' '))
+        self.alert_window = dt.timedelta(minutes=init.get('alert_minutes', 15))
 
 
     def parse_one_sighting(self, raw_text):
@@ -82,11 +90,13 @@ class Segment(SegmentParent):
 
 
     def parse_sightings(self, soup):
-        # Returns empty list on any errors reading/parsing sightings
+        # Returns list of sightings, which may legitimately be empty
         sightings = []
         div = soup.find_all('div', {"id": "widget_info"})
-        # If there's more than one div, something's wrong
-        if len(div) > 1:
+        # If there isn't exactly one div, something's wrong
+        if len(div) != 1:
+            raise RefreshFailed('Sightings not found on page')
+        if len(div[0].contents) == 0:
             return sightings
         # Pull out text
         div_contents = div[0].contents[0]
@@ -103,33 +113,58 @@ class Segment(SegmentParent):
 
     def refresh_data(self):
         url = f'https://spotthestation.nasa.gov/sightings/view.cfm?country={self.country}&region={self.region}&city={self.city}'
-        soup = self.get_soup(url)
-        if soup is not None:
-            self.data = {'fetched_on': dt.datetime.now()}
-            self.data['sightings'] = self.parse_sightings(soup)
+        soup = self.get_soup(url, only=WIDGET_ONLY)
+        if soup is None:
+            raise RefreshFailed('Spot the Station page unavailable')
+        self.data = {'fetched_on': clock.now(),
+                     'sightings': self.parse_sightings(soup)}
+
+
+    # Sightings only become urgent as they get close, so this gets checked
+    # between segments, not just when the data's refreshed
+    def check_alerts(self, data):
+        # alert_minutes = 0 turns alerts off altogether
+        if self.alert_window <= dt.timedelta(0):
+            return
+        now = clock.now()
+        for s in data['sightings']:
+            # Still worth a look up to 5 minutes after it starts, same as show()
+            deadline = s['date_time'] + dt.timedelta(minutes=5)
+            if s['date_time'] - now <= self.alert_window and deadline > now:
+                self.post_alert(s['date_time'], 'ISS Overhead Soon',
+                                [self.location,
+                                 f"{s['date_text']} @ {s['time_text']}",
+                                 f"Visible for {s['visible']}",
+                                 f"Max height {s['max_height']} Degrees",
+                                 f"From {s['appears']}",
+                                 f"To   {s['disappears']}"],
+                                deadline, priority=1)
 
 
     def show(self, fmt):
         max_sightings = fmt.get('max_sightings', 3)
         if max_sightings < 0:
             max_sightings = 0
-        if self.data_is_stale():
+        if self.needs_refresh():
             self.d.print_update_msg('Updating Station Data')
-            self.refresh_data()
+            self.refresh_if_stale()
 
         self.d.print_header('Spot the Station', '>', '<')
         self.d.newline()
     
         # Exit early if nothing to show at all
-        if len(self.data['sightings']) == 0:
+        if self.data is None or len(self.data['sightings']) == 0:
             self.d.print('No ISS Sightings Available')
             return
 
         self.d.print(self.location)
+        note = self.stale_note()
+        if note is not None:
+            self.d.print(note)
         self.d.print('Upcoming ISS Sightings:')
         
         num_shown = 0
-        cutoff_dt = dt.datetime.now() - dt.timedelta(minutes=5)
+        cutoff_dt = clock.now() - dt.timedelta(minutes=5)
         for s in self.data['sightings']:
             if s['date_time'] >= cutoff_dt and num_shown < max_sightings:
                 self.d.newline(self.d.beat_delay)
@@ -17,7 +17,7 @@
 #
 ################################################################################
 
-import datetime as dt
+import clock
 from segment_parent import SegmentParent
 
 
@@ -36,24 +36,44 @@ class Segment(SegmentParent):
 
 
     def refresh_data(self):
-        self.data = {'fetched_on':dt.datetime.now(),
-                     }
+        # Always use clock.now() for the current time, rather than calling
+        # datetime.now() directly, so that headless mode works properly
+        # Build up the new data separately, then assign it to self.data
+        # all at once at the end (refreshes can happen in the background,
+        # while an older version of the data is still being shown)
+        data = {'fetched_on':clock.now(),
+               }
         # Do fetching here (webscraping, RSS, API, file read, etc.)
+        # If it doesn't work out, raise RefreshFailed (from segment_parent)
+        # instead of assigning empty data.  The old data will be kept, and
+        # the refresh retried later.
         # For now, we'll just assign a string constant and imagine we did
         # something fancier...
-        self.data['message'] = 'hello, world'
+        data['message'] = 'hello, world'
+        self.data = data
 
 
 
     def show(self, fmt):
         # Refresh if needed
-        if self.data_is_stale():
+        if self.needs_refresh():
             self.d.print_update_msg('Updating Data')
-            self.refresh_data()
+            self.refresh_if_stale()
 
         self.d.print_header('Template', '=')
         self.d.newline()
 
+        # Data can still be None if the very first refresh failed
+        if self.data is None:
+            self.d.print('No data available')
+            self.d.newline()
+            return
+
+        # Let the viewer know if the data is getting old
+        note = self.stale_note()
+        if note is not None:
+            self.d.print(note)
+
         self.d.print(self.data['message'])
         self.d.newline()
 
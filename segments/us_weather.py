@@ -17,6 +17,20 @@
 #                  If omitted, the "consitions" location from weather.gov for
 #                  for the given lat & lon is used
 #
+#       locations  Optional list of several locations, each with its own lat,
+#                  lon, and (optional) location, like so:
+#                    locations = [{lat=36.12, lon=-86.80, location='Nashville'},
+#                                 {lat=42.36, lon=-71.01, location='Boston'}]
+#                  All of them are refreshed at once, in one batch.  If this
+#                  is given, the single lat/lon/location above are ignored.
+#
+#       fetch_workers   Number of locations to fetch at the same time
+#                       (default=8, min=1, max=16)
+#
+#       hazard_alerts   true/false.  If true (the default), break in with an
+#                       alert as soon as a new hazard shows up for any
+#                       location, instead of waiting for this segment's turn.
+#
 #   - Format parameters:
 #
 #       forecast_periods  Maximum number of forecast periods, out of however
@@ -25,17 +39,29 @@
 #                         If it's 2 or higher, forecasts are preceeded by an
 #                         "extended forecast" header.
 #
+#       table             true/false.  If true, show a compact table with one
+#                         line per location, instead of the full weather for
+#                         each one.  Defaults to true when there's a list of
+#                         locations, false otherwise.
+#
 #
 #   Jeff Jetton, Jan-Mar 2023
 #
 ################################################################################
 
 
+from bs4 import SoupStrainer
+import clock
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
-from segment_parent import SegmentParent
+from segment_parent import RefreshFailed, SegmentParent
 
 INTRO = 'Weather provided by weather.gov'
 
+# Kinds of elements we pull data out of (current conditions heading and
+# text, the stats table, forecast icons, and hazard links)
+FORECAST_ONLY = SoupStrainer(['h2', 'p', 'td', 'img', 'a'])
+
 
 class Segment(SegmentParent):
     
@@ -53,6 +79,23 @@ class Segment(SegmentParent):
             self.lat = 36.116453
             self.lon = -86.675228
             self.location = 'Default Location (BNA)'
+        # Optional list of locations, fetched all together.  Each is a
+        # dictionary of lat, lon, and location (which may be None).
+        self.places = None
+        if 'locations' in init:
+            self.places = []
+            for place in init['locations']:
+                if 'lat' not in place or 'lon' not in place:
+                    raise RuntimeError('Each us_weather location needs a lat and lon')
+                self.places.append({'lat':place['lat'], 'lon':place['lon'],
+                                    'location':place.get('location', None)})
+            if len(self.places) == 0:
+                raise RuntimeError('us_weather locations list is empty')
+            # Hang onto the parsed page for every location
+            self.keep_soups = max(self.keep_soups, len(self.places))
+        self.fetch_workers = self.clamp(init.get('fetch_workers', 8), 1, 16)
+        self.hazard_alerts = init.get('hazard_alerts', True)
+        self._executor = None
 
 
     @classmethod
@@ -71,21 +114,6 @@ class Segment(SegmentParent):
         return 'Oppressive'
 
 
-    def assign_na(self):
-        self.data['conditions_location'] = 'N/A'
-        self.data['currently'] = 'N/A'
-        self.data['temp_f'] = 'N/A'
-        self.data['temp_c'] = 'N/A'
-        self.data['humidity'] = 'N/A'
-        self.data['barometer'] = 'N/A'
-        self.data['comfort'] = ''
-        self.data['last_update'] = 'N/A'
-        self.data['wind_speed'] = 'N/A'
-        self.data['visibility'] = 'N/A'
-        self.data['dewpoint'] = 'N/A'
-        self.data['periods'] = [{'timeframe':'Forecast Not Available',
-                                 'forecast':''}]
-
     @classmethod
     def string_to_dt(cls, s):
         # Convert a string in weather.gov's "last update" format to a
@@ -100,7 +128,7 @@ class Segment(SegmentParent):
             dt_string = dt_string[0:col_pos-1] + '0' + dt_string[col_pos-1:]
         # Assume year is current year (possibly inaccurate just after
         # midnight on New Year's Eve... oh well)
-        dt_string = f"{dt.datetime.now().year} {dt_string}"
+        dt_string = f"{clock.now().year} {dt_string}"
         # Pull out the last word (presumably the time zone code)
         tz = dt_string[dt_string.rfind(' ')+1:]
         # If it matches an offset, replace code with offset and convert
@@ -114,27 +142,69 @@ class Segment(SegmentParent):
         return dt_object
 
 
+    def restore_snapshot(self, data):
+        super().restore_snapshot(data)
+        if self.places is None and (self.location == None or self.location.strip() == ''):
+            self.location = data.get('conditions_location')
+
+
     def refresh_data(self):
-        self.data = {'fetched_on':dt.datetime.now(),
-                     'periods':[],
-                     'hazards':[]}
+        if self.places is not None:
+            self.refresh_places()
+            return
+        data = self.get_weather(self.lat, self.lon)
+        # If object wasn't instantiated with a location, set it to whatever came back from fetch
+        if self.location == None or self.location.strip() == '':
+            self.location = data['conditions_location']
+        self.data = data
 
-        url = f'https://forecast.weather.gov/MapClick.php?lat={self.lat}&lon={self.lon}'
-        soup = self.get_soup(url)
+
+    # Fetches every location in the list at the same time.  A location that
+    # can't be fetched keeps its weather from last time, if there was any.
+    def refresh_places(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+        futures = [self._executor.submit(self.get_weather, place['lat'], place['lon'])
+                   for place in self.places]
+        old_places = self.data['places'] if self.data is not None else [None] * len(self.places)
+        data = {'fetched_on':clock.now(),
+                'places':[]}
+        for place, future, old_place in zip(self.places, futures, old_places):
+            try:
+                weather = future.result()
+            except Exception:
+                weather = old_place['weather'] if old_place is not None else None
+            location = place['location']
+            if location is None or location.strip() == '':
+                if weather is not None:
+                    location = weather['conditions_location']
+                else:
+                    location = f'{place["lat"]}, {place["lon"]}'
+            data['places'].append({'location':location, 'weather':weather})
+        if all(place['weather'] is None for place in data['places']):
+            raise RefreshFailed('Weather unavailable for all locations')
+        self.data = data
+
+
+    # Returns a dictionary of current conditions, forecast, etc., for one
+    # location
+    def get_weather(self, lat, lon):
+        data = {'fetched_on':clock.now(),
+                'periods':[],
+                'hazards':[]}
+
+        url = f'https://forecast.weather.gov/MapClick.php?lat={lat}&lon={lon}'
+        soup = self.get_soup(url, only=FORECAST_ONLY)
         # Even if not None, also check one element to make sure the site is
         # currently showing weather (i.e. isn't down but still returning soup)
         if soup is None or soup.find('h2', 'panel-title') is None:
-            self.assign_na()
-            return
+            raise RefreshFailed('Weather page unavailable')
 
         # Parse away...
-        self.data['conditions_location'] = self.d.clean_chars(soup.find('h2', 'panel-title').string)
-        # If object wasn't instantiated with a location, set it to whatever came back from fetch
-        if self.location == None or self.location.strip() == '':
-            self.location = self.data['conditions_location']
-        self.data['currently'] = self.d.clean_chars(soup.find('p', 'myforecast-current').string)
-        self.data['temp_f'] = self.d.clean_chars(soup.find('p', 'myforecast-current-lrg').string)
-        self.data['temp_c'] = self.d.clean_chars(soup.find('p', 'myforecast-current-sm').string)
+        data['conditions_location'] = self.d.clean_chars(soup.find('h2', 'panel-title').string)
+        data['currently'] = self.d.clean_chars(soup.find('p', 'myforecast-current').string)
+        data['temp_f'] = self.d.clean_chars(soup.find('p', 'myforecast-current-lrg').string)
+        data['temp_c'] = self.d.clean_chars(soup.find('p', 'myforecast-current-sm').string)
 
         # Various weather stats are stored as table data in the sole table
         cells = soup.find_all('td')
@@ -143,15 +213,15 @@ class Segment(SegmentParent):
             if key is None:
                 key = cell.string.lower().replace(' ', '_')
             else:
-                self.data[key] = self.d.clean_chars(cell.string)
+                data[key] = self.d.clean_chars(cell.string)
                 key = None
 
         # Try to convert the "last_update" text to a real datetime value
-        if 'last_update' in self.data:
-            self.data['last_update_dt'] = self.string_to_dt(self.data['last_update'])
+        if 'last_update' in data:
+            data['last_update_dt'] = self.string_to_dt(data['last_update'])
 
         # Text description of the dewpoint
-        self.data['comfort'] = self.get_comfort_from_dewpoint(self.data['dewpoint'])
+        data['comfort'] = self.get_comfort_from_dewpoint(data['dewpoint'])
 
         # Get period forecast from the alt-text of the weather icons
         icons = soup.find_all('img', 'forecast-icon')
@@ -163,14 +233,16 @@ class Segment(SegmentParent):
             if len(split_text) == 2:
                 period = {'timeframe':self.d.clean_chars(split_text[0]),
                           'forecast':self.d.clean_chars(split_text[1])}
-                self.data['periods'].append(period)
+                data['periods'].append(period)
 
         # Any hazard headlines?
         hazards = soup.find_all('a', 'anchor-hazards')
         for hazard in hazards:
             stripped_haz = hazard.contents[0].strip()
             if stripped_haz != 'Hazardous Weather Outlook' and stripped_haz != '':
-                self.data['hazards'].append(self.d.clean_chars(stripped_haz))
+                data['hazards'].append(self.d.clean_chars(stripped_haz))
+
+        return data
 
 
     # Override to add one more stale condition
@@ -181,46 +253,127 @@ class Segment(SegmentParent):
             return True
         else:
             # Data is always stale if (slightly) more than an hour has gone by
-            now = dt.datetime.now()
-            return 'last_update_dt' in self.data and now.astimezone() - self.data['last_update_dt'] >= dt.timedelta(minutes=62)
+            if self.places is None:
+                return self.is_out_of_date(self.data)
+            return any(self.is_out_of_date(place['weather']) for place in self.data['places'])
 
 
+    @classmethod
+    def is_out_of_date(cls, weather):
+        if weather is None or 'last_update_dt' not in weather:
+            return False
+        return clock.now().astimezone() - weather['last_update_dt'] >= dt.timedelta(minutes=62)
+
+
+
+    # Each hazard gets one alert (a day, at most) per location.  One that
+    # can't be shown within half an hour is left for the segment itself.
+    def check_alerts(self, data):
+        if not self.hazard_alerts:
+            return
+        if self.places is None:
+            places = [(self.location, data)]
+        else:
+            places = [(place['location'], place['weather']) for place in data['places']]
+        deadline = clock.now() + dt.timedelta(minutes=30)
+        for location, weather in places:
+            if weather is None:
+                continue
+            for hazard in weather['hazards']:
+                self.post_alert((location, hazard), 'Weather Alert',
+                                [location, '!!! ' + hazard],
+                                deadline, priority=2)
+
+
+    # Nothing shown depends on anything but the data and format
+    def output_is_reusable(self, fmt):
+        return True
+
 
     def show(self, fmt):
         forecast_periods = fmt.get('forecast_periods', 5)
         forecast_periods = self.clamp(forecast_periods, 0, 15)
+        table = fmt.get('table', self.places is not None)
 
-        if self.data_is_stale():
+        if self.needs_refresh():
             self.d.print_update_msg('Checking for Weather Updates')
-            self.refresh_data()
+            self.refresh_if_stale()
+
+        # Put everything in (location, weather) pairs
+        if self.places is None:
+            places = [(self.location, self.data)]
+        elif self.data is None:
+            places = [(place['location'] or f'{place["lat"]}, {place["lon"]}', None) for place in self.places]
+        else:
+            places = [(place['location'], place['weather']) for place in self.data['places']]
 
-        self.d.print(f'Weather at {self.location}')
-        self.d.print(f'As of {self.data["last_update"]}')
+        if table:
+            self.show_table(places)
+            return
+        for i, (location, weather) in enumerate(places):
+            if i > 0:
+                self.d.newline(self.d.beat_delay)
+                self.d.newline()
+            self.show_weather(location, weather, forecast_periods)
+
+
+    # Full conditions and forecast for one location
+    def show_weather(self, location, weather, forecast_periods):
+        self.d.print(f'Weather at {location}')
+        if weather is None:
+            self.d.newline()
+            self.d.print('Weather Not Available')
+            return
+        self.d.print(f'As of {weather["last_update"]}')
+        note = self.stale_note()
+        if note is not None:
+            self.d.print(note)
     
-        if len(self.data['hazards']) > 0:
-            for hazard in self.data['hazards']:
+        if len(weather['hazards']) > 0:
+            for hazard in weather['hazards']:
                 self.d.newline()
                 self.d.print('!!! ' + hazard)
             
         self.d.newline()
-        self.d.print(f'    Conditions   {self.data["currently"]}')
-        self.d.print(f'    Temperature  {self.data["temp_f"]} ({self.data["temp_c"]})')
-        self.d.print(f'    Wind         {self.data["wind_speed"]}')
-        self.d.print(f'    Visibility   {self.data["visibility"]}')
-        self.d.print(f'    Dewpoint     {self.data["dewpoint"]} {self.data["comfort"]}')
+        self.d.print(f'    Conditions   {weather["currently"]}')
+        self.d.print(f'    Temperature  {weather["temp_f"]} ({weather["temp_c"]})')
+        self.d.print(f'    Wind         {weather["wind_speed"]}')
+        self.d.print(f'    Visibility   {weather["visibility"]}')
+        self.d.print(f'    Dewpoint     {weather["dewpoint"]} {weather["comfort"]}')
         # TODO: only show comfort if warm enough?
 
-        forecast_periods == min(forecast_periods, len(self.data['periods']))
+        forecast_periods == min(forecast_periods, len(weather['periods']))
         if forecast_periods > 0:
             self.d.newline(self.d.beat_delay)
             if forecast_periods > 1:
                 self.d.newline()
                 self.d.print_header('Extended Forecast', '*')
 
-            for period in self.data['periods'][0:forecast_periods]:
+            for period in weather['periods'][0:forecast_periods]:
                 self.d.newline(self.d.beat_delay)
                 if forecast_periods > 1:
                     self.d.print(period['timeframe'])
                 self.d.print(period['forecast'])
 
 
+    # One line per location:  name, temperature, and current conditions,
+    # with a "!" in front of any location that has hazards
+    def show_table(self, places):
+        self.d.print_header('Weather Roundup', '*')
+        note = self.stale_note()
+        if note is not None:
+            self.d.print(note)
+        self.d.newline()
+        name_width = self.clamp(self.d.width // 3, 8, 20)
+        for location, weather in places:
+            if weather is None:
+                line = f'  {location:<{name_width}.{name_width}}  N/A'
+            else:
+                flag = '!' if len(weather['hazards']) > 0 else ' '
+                line = f'{flag} {location:<{name_width}.{name_width}} {weather["temp_f"]:>5}  {weather["currently"]}'
+            self.d.print(line[:self.d.width])
+        if any(weather is not None and len(weather['hazards']) > 0 for location, weather in places):
+            self.d.newline()
+            self.d.print('! = Hazardous weather')
+
+
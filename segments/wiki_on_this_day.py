@@ -11,20 +11,91 @@
 #
 #   - Format parameters:  none
 #
+#   The page is read and parsed a piece at a time as it downloads, and the
+#   download is dropped as soon as the list of events has been read, since
+#   we don't need anything after that.
+#
 #
 #   Jeff Jetton, April 2023
 #
 ################################################################################
 
-from bs4 import BeautifulSoup
-import datetime as dt
+import clock
+from html.parser import HTMLParser
 import re
-import requests
-from segment_parent import SegmentParent
+from segment_parent import RefreshFailed, SegmentParent
 
 
 INTRO = '"On This Day" provided by Wikipedia.com'
 
+# Parenthetical references to media, like (featured), (portrait depicted),
+# and (example pictured)
+MEDIA_PATTERN = re.compile(r' \([^\)]*(pictured|depicted|featured)\)', flags=re.IGNORECASE)
+
+# Size of the pieces the page is read in
+CHUNK_BYTES = 16 * 1024
+
+
+# Picks the items out of the first list following the second link to today's
+# date page, which is where the "on this day" events are.  Sets done once
+# that list is finished, so the rest of the page can be skipped.
+class EventListParser(HTMLParser):
+
+    def __init__(self, today, today_formatted):
+        super().__init__(convert_charrefs=True)
+        self.href = f'/wiki/{today_formatted}'
+        self.today = today
+        self.links_seen = 0
+        self.link_text = None
+        # How many lists deep we are, and the text of the current item
+        self.list_depth = 0
+        self.item_text = None
+        self.items = []
+        self.done = False
+
+    def handle_starttag(self, tag, attrs):
+        if self.done:
+            return
+        if self.list_depth == 0:
+            if tag == 'a' and self.links_seen < 2:
+                attrs = dict(attrs)
+                if attrs.get('href') == self.href and attrs.get('title') == self.today:
+                    self.link_text = ''
+            elif tag == 'ul' and self.links_seen >= 2:
+                self.list_depth = 1
+        elif tag == 'ul':
+            self.list_depth += 1
+        elif tag == 'li' and self.list_depth == 1:
+            self.end_item()
+            self.item_text = []
+
+    def handle_endtag(self, tag):
+        if self.done:
+            return
+        if self.link_text is not None and tag == 'a':
+            if self.link_text == self.today:
+                self.links_seen += 1
+            self.link_text = None
+        elif self.list_depth > 0:
+            if tag == 'ul':
+                self.list_depth -= 1
+                if self.list_depth == 0:
+                    self.end_item()
+                    self.done = True
+            elif tag == 'li' and self.list_depth == 1:
+                self.end_item()
+
+    def handle_data(self, data):
+        if self.link_text is not None:
+            self.link_text += data
+        elif self.item_text is not None:
+            self.item_text.append(data)
+
+    def end_item(self):
+        if self.item_text is not None:
+            self.items.append(''.join(self.item_text))
+            self.item_text = None
+
 
 class Segment(SegmentParent):
 
@@ -33,41 +104,46 @@ class Segment(SegmentParent):
         super().__init__(display, init, default_intro=INTRO)
 
 
-    def parse_list(self, lst):
-        list_items = lst.find_all('li')
+    def add_items(self, list_items, data):
         for list_item in list_items:
-            list_item = self.d.clean_chars(list_item.get_text())
-            # Try to remove parenthetical references to media, like (featured),
-            # (portrait depicted), and (example pictured)
-            pattern = ' \([^\)]*(pictured|depicted|featured)\)'
-            list_item = re.sub(pattern, '', list_item, flags=re.IGNORECASE)
-            self.data['items'].append(list_item)
+            list_item = self.d.clean_chars(list_item)
+            # Try to remove parenthetical references to media
+            list_item = MEDIA_PATTERN.sub('', list_item)
+            data['items'].append(list_item)
 
 
     def refresh_data(self):
-        self.data = {'fetched_on':dt.datetime.now(),
-                     'item_index':0,
-                     'items':[]
-                    }
-        today = dt.date.today()
+        data = {'fetched_on':clock.now(),
+                'item_index':0,
+                'items':[]
+               }
+        today = clock.now().date()
         # Format as full month plus day-of-month w/o leading zero
-        self.data['today'] = today.strftime('%B %d').replace(' 0', ' ')
+        data['today'] = today.strftime('%B %d').replace(' 0', ' ')
         url = 'https://en.wikipedia.org/wiki/Wikipedia:Selected_anniversaries/'
-        today_formatted = self.data['today'].replace(' ', '_')
+        today_formatted = data['today'].replace(' ', '_')
         url += today_formatted
-        # Get raw source first
-        response = requests.get(url, headers={'Cache-Control': 'no-cache'})
-        if response.status_code != 200:
-            return
-        # Split it on "today" page links
-        link = f"<a href=\"/wiki/{today_formatted}\" title=\"{self.data['today']}\">{self.data['today']}</a>"
-        # Get each list found in the third chunk
-        soup = BeautifulSoup(response.text.split(link)[2], 'html.parser')
-        lists = soup.find_all('ul')
-        # First list only, for now (the birth/death list often has obscure names)
-        self.parse_list(lists[0])
+        # Parse the page as it comes in, until we've got the first list
+        # after the second "today" link.  (First list only, for now... the
+        # birth/death list often has obscure names.)
+        parser = EventListParser(data['today'], today_formatted)
+        with self.fetch_stream(url) as response:
+            if response.status_code != 200:
+                raise RefreshFailed(f'Wikipedia returned status {response.status_code}')
+            if response.encoding is None:
+                response.encoding = 'utf-8'
+            for chunk in response.iter_content(chunk_size=CHUNK_BYTES, decode_unicode=True):
+                parser.feed(chunk)
+                if parser.done:
+                    break
+        if not parser.done:
+            raise RefreshFailed('Unexpected Wikipedia page layout')
+        self.add_items(parser.items, data)
+        if len(data['items']) == 0:
+            raise RefreshFailed('No "On This Day" items found')
         # Put in "newest to oldest" order
-        self.data['items'].reverse()
+        data['items'].reverse()
+        self.data = data
 
 
     def show(self, fmt):
@@ -76,11 +152,21 @@ class Segment(SegmentParent):
         if items_to_show < 0:
             items_to_show = 1
         # Refresh if needed
-        if self.data_is_stale():
+        if self.needs_refresh():
             self.d.print_update_msg('Consulting Wikipedia')
-            self.refresh_data()
+            self.refresh_if_stale()
+        # Nothing fetched yet?
+        if self.data is None:
+            self.d.print_header('On This Day', '-')
+            self.d.newline()
+            self.d.print('No "On This Day" data available')
+            self.d.newline(self.d.beat_delay)
+            return
         # Header
         self.d.print_header(self.data['today'] + ': On This Day', '-')
+        note = self.stale_note()
+        if note is not None:
+            self.d.print(note)
         self.d.newline()
         # No items fetched for some weird reason?
         if len(self.data['items']) == 0:
@@ -16,12 +16,16 @@
 #
 ################################################################################
 
-import datetime as dt
-from segment_parent import SegmentParent
+from bs4 import SoupStrainer
+import clock
+from segment_parent import RefreshFailed, SegmentParent
 
 
 INTRO = 'Financial info from finance.yahoo.com'
 
+# The only part of the page we need
+STREAMERS_ONLY = SoupStrainer('fin-streamer')
+
 
 class Segment(SegmentParent):
 
@@ -80,30 +84,42 @@ class Segment(SegmentParent):
 
 
     def refresh_data(self):
-        self.data = {'fetched_on':dt.datetime.now(),
-                     'indexes':[],
-                    }
-        soup = self.get_soup('https://finance.yahoo.com')
+        data = {'fetched_on':clock.now(),
+                'indexes':[],
+               }
+        soup = self.get_soup('https://finance.yahoo.com', only=STREAMERS_ONLY)
         if soup is None:
-            return
+            raise RefreshFailed('Yahoo Finance page unavailable')
         streamers = soup.find_all('fin-streamer')
-        self.data['indexes'] = self.parse_indexes(streamers)
-        self.data['indexes'] = self.process_indexes(self.data['indexes'])
+        data['indexes'] = self.process_indexes(self.parse_indexes(streamers))
+        # Don't replace the numbers we've got with nothing
+        if len(data['indexes']) == 0:
+            raise RefreshFailed('No market data found')
+        self.data = data
+
+
+    # Same data, same output
+    def output_is_reusable(self, fmt):
+        return True
 
 
     def show(self, fmt):
         # Check for need to refresh
-        if self.data_is_stale():
+        if self.needs_refresh():
             self.d.print_update_msg('Updating Financial Data')
-            self.refresh_data()
+            self.refresh_if_stale()
 
         self.d.print_header('Stocks', '$')
         self.d.newline()
 
-        if len(self.data['indexes']) == 0:
+        if self.data is None or len(self.data['indexes']) == 0:
             self.d.print("No market data available")
-        else:
-            self.d.print(f"As of {self.d.fmt_time_text(self.data['fetched_on'])}")
+            return
+
+        self.d.print(f"As of {self.d.fmt_time_text(self.data['fetched_on'])}")
+        note = self.stale_note()
+        if note is not None:
+            self.d.print(note)
 
         for i in self.data['indexes']:
             self.d.newline()
@@ -0,0 +1,77 @@
+################################################################################
+#
+#   SingleFlight Class
+#
+#   - Makes sure that when several threads ask for the same piece of work at
+#     about the same time (like two segments fetching the same page), it only
+#     gets done once.  Whoever asks first does the work, and everyone else
+#     just waits for it and gets the same result.
+#   - A finished result is also handed out to anyone who asks for it within a
+#     short window afterward, since "at about the same time" doesn't always
+#     mean "while the first one was still in progress"
+#   - Failures aren't kept around.  Threads already waiting get the same
+#     exception, but the next one to ask will try again.
+#
+################################################################################
+
+import threading
+import time
+
+
+class _Flight:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+
+class SingleFlight:
+
+    def __init__(self, window_seconds=1):
+        self.window_seconds = window_seconds
+        self._flights = {}
+        self._lock = threading.Lock()
+        # How many callers got a result somebody else did the work for
+        self.shared = 0
+
+
+    # Returns fn(), or the result of a call for the same key that's either in
+    # progress right now or finished within the window
+    def do(self, key, fn):
+        with self._lock:
+            self._forget_old()
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+            else:
+                self.shared += 1
+        if leader:
+            try:
+                flight.result = fn()
+            except BaseException as e:
+                flight.error = e
+            with self._lock:
+                if flight.error is not None or self.window_seconds <= 0:
+                    del self._flights[key]
+                else:
+                    flight.finished_at = time.monotonic()
+            flight.done.set()
+        else:
+            flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+
+    # Drop finished results that are past the window.  Called with the lock
+    # held.
+    def _forget_old(self):
+        now = time.monotonic()
+        old = [key for key, flight in self._flights.items()
+               if flight.finished_at is not None and now - flight.finished_at >= self.window_seconds]
+        for key in old:
+            del self._flights[key]
@@ -0,0 +1,152 @@
+################################################################################
+#
+#   Sink Class
+#
+#   - One output "screen" fed by the Display:  standard output, a file, a
+#     terminal device, etc.
+#   - Each sink has its own width, print speeds, and uppercase setting, and
+#     handles the layout (wrapping, centering) of text for its own screen
+#   - Any setting a sink doesn't specify is taken from the main [display]
+#     section of the config file
+#
+#   Serial sinks (a vintage terminal on a serial port, say) are set to the
+#   configured baud rate and flow control, and never get sent text faster than
+#   the line can carry it.  If the configured cps is at or above what the line
+#   can do, text is handed over in bulk and the line itself does the pacing.
+#
+#   Any sink can also keep a model of its screen (see screen.py), and then
+#   only send the characters that actually change, using cursor addressing.
+#
+#   Sinks are set up by the Display, from the optional list of "sinks" in the
+#   [display] section.  If there isn't one, the Display just makes a single
+#   sink for standard output, using the main [display] settings.
+#
+################################################################################
+
+import os
+import random
+import textwrap
+
+from pacing import Pacer
+from screen import Screen
+
+
+SINK_TYPES = ['stdout', 'file', 'serial']
+FLOW_CONTROLS = ['none', 'xonxoff', 'rtscts']
+
+# Bits sent down a serial line per character:  start + 8 data + stop
+BITS_PER_CHAR = 10
+
+
+class Sink:
+
+    def __init__(self, sink_settings, display_settings):
+        # Use the sink's own setting if it has one, otherwise the display's
+        def setting(key, default):
+            return sink_settings.get(key, display_settings.get(key, default))
+        self.type = sink_settings.get('type', 'stdout')
+        if self.type not in SINK_TYPES:
+            raise RuntimeError(f'Unknown display sink type "{self.type}"')
+        self.width = setting('width', 40)
+        self.height = setting('height', 24)
+        self.cps = setting('cps', 20)
+        self.newline_cps = setting('newline_cps', 100)
+        self.force_uppercase = setting('force_uppercase', True)
+        # Serial lines have a top speed of their own
+        line_cps = None
+        if self.type == 'serial':
+            self.baud = sink_settings.get('baud', 9600)
+            self.flow_control = sink_settings.get('flow_control', 'none')
+            if self.flow_control not in FLOW_CONTROLS:
+                raise RuntimeError(f'Unknown serial flow control "{self.flow_control}"')
+            line_cps = self.baud / BITS_PER_CHAR
+            self.cps = min(self.cps, line_cps)
+            self.newline_cps = min(self.newline_cps, line_cps)
+        # Optionally keep a model of the screen, so we only send what changes
+        self.screen = None
+        encode = None
+        screen_model = sink_settings.get('screen_model', 'none')
+        if screen_model != 'none':
+            self.screen = Screen(self.height, self.width, screen_model,
+                                 sink_settings.get('use_rep', False))
+            encode = self.screen.encode
+        self.pacer = Pacer(self.open_output(sink_settings), bulk_cps=line_cps, encode=encode)
+
+
+    # Returns a file descriptor for the sink's output
+    def open_output(self, sink_settings):
+        if self.type == 'file':
+            if 'path' not in sink_settings:
+                raise RuntimeError('Display sinks of type "file" need a path')
+            # Append, so that restarts don't wipe out an existing log
+            return os.open(sink_settings['path'], os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if self.type == 'serial':
+            if 'path' not in sink_settings:
+                raise RuntimeError('Display sinks of type "serial" need a path (like /dev/ttyUSB0)')
+            return self.open_serial(sink_settings['path'])
+        return None
+
+
+    # Opens and configures a serial device (or pty) for output only.  The file
+    # descriptor is non-blocking, so the Pacer can wait on flow control.
+    def open_serial(self, path):
+        import termios
+        speed = getattr(termios, f'B{self.baud}', None)
+        if speed is None:
+            raise RuntimeError(f'Unsupported baud rate: {self.baud}')
+        fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        iflag, oflag, cflag, lflag, ispeed, ospeed, cc = termios.tcgetattr(fd)
+        # Raw-ish:  No echo, no input processing, 8 bits, no parity, 1 stop
+        # bit.  Output processing stays on, so newlines go out as CR+LF.
+        iflag &= ~(termios.IXON | termios.IXOFF | termios.IXANY | termios.ICRNL | termios.INLCR)
+        oflag |= termios.OPOST | termios.ONLCR
+        cflag &= ~(termios.PARENB | termios.CSTOPB | termios.CSIZE)
+        cflag |= termios.CS8 | termios.CREAD | termios.CLOCAL
+        lflag = 0
+        # Flow control is handled by the OS.  When the terminal says to stop,
+        # writes just stop being accepted until it says to go again.
+        if self.flow_control == 'xonxoff':
+            iflag |= termios.IXON
+        elif self.flow_control == 'rtscts':
+            if not hasattr(termios, 'CRTSCTS'):
+                raise RuntimeError('RTS/CTS flow control is not supported on this system')
+            cflag |= termios.CRTSCTS
+        elif hasattr(termios, 'CRTSCTS'):
+            cflag &= ~termios.CRTSCTS
+        termios.tcsetattr(fd, termios.TCSANOW, [iflag, oflag, cflag, lflag, speed, speed, cc])
+        return fd
+
+
+    # Closes the output (unless it's standard output, which stays open)
+    def close(self):
+        if self.type != 'stdout':
+            os.close(self.pacer.fd)
+
+
+    # Returns pacing steps for printing s, wrapped to this sink's width
+    def print_steps(self, s, end='\n'):
+        if self.force_uppercase:
+            s = s.upper()
+        if len(s) <= self.width:
+            return [(s + end, self.cps)]
+        return [(line + end, self.cps) for line in textwrap.wrap(s, self.width)]
+
+
+    # Returns pacing steps for a "slow" blank line, with an optional pause
+    # at some random horizontal point (to avoid(?) screen burn-in)
+    def newline_steps(self, delay=None):
+        pause_pos = random.randrange(self.width)
+        steps = [(' ' * (pause_pos + 1), self.newline_cps)]
+        if delay is not None:
+            steps.append((None, delay))
+        steps.append((' ' * (self.width - pause_pos - 1) + '\n', self.newline_cps))
+        return steps
+
+
+    # Returns pacing steps for a header line, centered between markers
+    def header_steps(self, s, left_marker, right_marker):
+        num_markers = 0
+        if len(s) + 4 < self.width:
+            num_markers = int((self.width - 4 - len(s)) / 2)
+        line = left_marker * num_markers + '  ' + s + '  ' + right_marker * num_markers
+        return self.print_steps(line)
@@ -0,0 +1,114 @@
+################################################################################
+#
+#   SnapshotStore Class
+#
+#   - Saves every segment's data (including things like when it was fetched,
+#     and which item is up next) to a file every so often, and loads it back
+#     in at start-up
+#   - That way, a restart can go right back to showing things, instead of
+#     re-fetching everything at once.  Segments only refresh once their
+#     restored data is actually stale.
+#   - Segments are created as the playlist gets to them (see segment_set.py),
+#     so each one gets its data back then.  Until that happens, its old data
+#     is kept in the file.
+#   - Each segment's snapshot is tagged with its settings from the config
+#     file.  If those have changed (a different city for the weather, say),
+#     the old data is ignored.
+#   - Turned on by the optional [state] section of the config file
+#
+#   The file is written to a temporary name and then renamed over the old one,
+#   so it's never left half-written if the power goes out at the wrong moment.
+#
+################################################################################
+
+import os
+import pickle
+import time
+
+
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+
+    def __init__(self, state_settings, segment_settings):
+        self.path = state_settings.get('snapshot_file', 'retrofeed_state.pickle')
+        self.save_seconds = state_settings.get('save_seconds', 60)
+        # Each segment's config, to make sure a snapshot was taken with the
+        # same settings
+        self.signatures = {}
+        # Loaded data for segments that haven't been created yet, by key
+        self._saved = {}
+        self.update(segment_settings)
+        self._last_save = None
+
+
+    # Takes on new segment settings (after the config file has changed).
+    # Any loaded data taken with the old settings is forgotten.
+    def update(self, segment_settings):
+        signatures = {key:repr(sorted(init.items())) for key, init in segment_settings.items()}
+        self._saved = {key:data for key, data in self._saved.items()
+                       if signatures.get(key) == self.signatures.get(key)}
+        self.signatures = signatures
+
+
+    # Reads in the saved data, to hand out with restore() as segments are
+    # created
+    def load(self):
+        self._saved = {}
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception:
+            # Unreadable for whatever reason, so just start fresh
+            return
+        if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+            return
+        for key, saved in snapshot['segments'].items():
+            if saved['signature'] == self.signatures.get(key):
+                self._saved[key] = saved['data']
+
+
+    # Gives a newly created segment its saved data back, if there is any.
+    # Returns whether it got any.
+    def restore(self, key, segment):
+        data = self._saved.pop(key, None)
+        if data is None:
+            return False
+        try:
+            segment.restore_snapshot(data)
+        except Exception:
+            # Data from an older version of the segment, probably
+            return False
+        return True
+
+
+    # Saves all segments' data, if it's been long enough since the last time
+    # (or regardless, if forced)
+    def save(self, segments, force=False):
+        now = time.monotonic()
+        if not force and self._last_save is not None and now - self._last_save < self.save_seconds:
+            return
+        self._last_save = now
+        snapshot = {'version':SNAPSHOT_VERSION,
+                    'segments':{},
+                   }
+        # Hang onto the old data of segments that haven't been created yet
+        for key, data in list(self._saved.items()):
+            snapshot['segments'][key] = {'signature':self.signatures.get(key), 'data':data}
+        for key, segment in segments.items():
+            data = segment.get_snapshot()
+            if data is not None:
+                snapshot['segments'][key] = {'signature':self.signatures.get(key), 'data':data}
+        tmp_path = self.path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except (OSError, pickle.PicklingError):
+            # Not worth stopping the show over.  We'll try again next time.
+            pass
@@ -0,0 +1,126 @@
+################################################################################
+#
+#   Transliterator Class
+#
+#   - Boils scraped text down to plain, printable ASCII
+#   - The bulk of any scraped text is already ASCII, so that part is handled
+#     entirely by byte-level encode/translate calls.  Only the occasional runs
+#     of non-ASCII characters get looked up in a translation table.
+#   - Fancy punctuation (curly quotes, dashes, ellipses, etc.) is swapped for
+#     ASCII look-alikes from a fixed table
+#   - Anything not in the table gets looked up once, the first time it's seen:
+#     accented letters are decomposed down to their plain ASCII base letter
+#     (an e with an acute accent just becomes "e"), and anything that has no
+#     sensible ASCII form is dropped.  The answer is remembered for next time.
+#   - Extra mappings can be passed in at creation (see "char_map" in the
+#     [display] section of the config file)
+#
+#   Used by Display.clean_chars(), which is what segments should call
+#
+################################################################################
+
+import codecs
+import threading
+import unicodedata
+
+
+# Substitutions for characters that don't decompose into anything useful
+BASE_MAP = {'\t':     '    ',   # Tab = four spaces
+            '\u2013': '-',      # Various dashes
+            '\u2014': '-',
+            '\u2015': '-',
+            '\u2016': '-',
+            '\u2017': '-',
+            '\u2018': "'",      # Single quotes
+            '\u2019': "'",
+            '\u201C': '"',      # Double quotes
+            '\u201D': '"',
+            '\u2022': '*',      # Bullet
+            '\u2026': '...',    # Ellipsis...
+            '\u00A9': '(c)',    # Copyright and Reg Trmk
+            '\u00AE': '(R)',
+           }
+
+
+class _TranslationTable(dict):
+
+    # Characters are looked up with [], so this gets called for any
+    # character we haven't run across yet.  Figure out what it should
+    # become and store that, so each character only goes through this once.
+    def __missing__(self, code):
+        # Split into base character plus accents, etc.  Keep the ASCII
+        # parts as long as everything else is just combining marks.
+        result = ''
+        for c in unicodedata.normalize('NFKD', chr(code)):
+            if 32 <= ord(c) <= 126:
+                result += c
+            elif not unicodedata.combining(c):
+                result = ''
+                break
+        self[code] = result
+        return result
+
+
+# Encoder error handler:  Swap in the table lookups for the offending run.
+# Registered just once, for every Transliterator.  clean() leaves its table
+# here first (one per thread, since segments clean text in the background).
+_current = threading.local()
+
+def _substitute(err):
+    table = _current.table
+    run = err.object[err.start:err.end]
+    return ''.join(table[ord(c)] for c in run), err.end
+
+codecs.register_error('transliterate', _substitute)
+
+
+class Transliterator:
+
+    def __init__(self, extra_map=None):
+        mappings = dict(BASE_MAP)
+        if extra_map is not None:
+            mappings.update(extra_map)
+        # Non-ASCII characters are looked up (and remembered) in this table
+        self._table = _TranslationTable()
+        # Plain ASCII is handled with byte-level operations, which are about
+        # as fast as Python gets:  one table for characters that swap for a
+        # single other character, a list of those that get deleted (control
+        # characters, such as returns), and a short list of those that expand
+        # into something longer (like tabs)
+        byte_table = bytearray(range(256))
+        deletes = bytearray(i for i in range(32))
+        deletes.append(127)
+        self._expansions = []
+        for c, replacement in mappings.items():
+            if len(c) != 1:
+                raise RuntimeError(f'Character map keys must be single characters: "{c}"')
+            if replacement is None:
+                replacement = ''
+            if not replacement.isascii():
+                raise RuntimeError(f'Character map values must be plain ASCII: "{replacement}"')
+            code = ord(c)
+            if code > 127:
+                self._table[code] = replacement
+                continue
+            if code in deletes:
+                deletes.remove(code)
+            if replacement == '':
+                deletes.append(code)
+            elif len(replacement) == 1:
+                byte_table[code] = ord(replacement)
+            else:
+                self._expansions.append((c.encode(), replacement.encode()))
+        self._byte_table = bytes(byte_table)
+        self._deletes = bytes(deletes)
+
+
+    # Returns passed string as plain ASCII, with whitespace stripped at ends
+    def clean(self, s):
+        # The ASCII encoder hands any runs of characters it can't encode to
+        # _substitute(), to look up in our table
+        _current.table = self._table
+        b = s.encode('ascii', 'transliterate')
+        b = b.translate(self._byte_table, self._deletes)
+        for c, replacement in self._expansions:
+            b = b.replace(c, replacement)
+        return b.decode('ascii').strip()
@@ -0,0 +1,55 @@
+################################################################################
+#
+#   Watchdog Functions
+#
+#   - run_with_deadline() runs a function in its own thread and waits for it,
+#     but only up to a time limit.  If the function is still going by then,
+#     it's abandoned (left to finish, or not, on its own) and Overrun is
+#     raised, so the caller can get on with things.
+#   - Used by SegmentParent to keep a hung web request or a runaway show()
+#     from freezing the whole feed
+#   - There's no safe way to actually stop a Python thread, so an abandoned
+#     show() is cut off by the Display instead:  the next time it tries to
+#     print anything, it gets an Abandoned exception (see Display.abandon())
+#
+################################################################################
+
+import threading
+
+
+# Raised to the caller when the function runs past its deadline
+class Overrun(Exception):
+    pass
+
+
+# Raised inside an abandoned thread to stop it in its tracks.  It's not an
+# Exception, so it won't get caught by the usual "except Exception" clauses.
+class Abandoned(BaseException):
+    pass
+
+
+# Returns fn()'s result (or raises its exception), or raises Overrun if it
+# takes longer than seconds.  on_abandon, if given, is called with the
+# abandoned thread before Overrun is raised.  With seconds of None, this is
+# just fn().
+def run_with_deadline(fn, seconds, name='deadline', on_abandon=None):
+    if seconds is None:
+        return fn()
+    outcome = {}
+    def target():
+        try:
+            outcome['result'] = fn()
+        except Abandoned:
+            pass
+        except BaseException as e:
+            outcome['error'] = e
+    thread = threading.Thread(target=target, name=name, daemon=True)
+    thread.start()
+    thread.join(seconds)
+    if thread.is_alive():
+        if on_abandon is not None:
+            on_abandon(thread)
+        raise Overrun(f'{name} took longer than {seconds} seconds')
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome.get('result')